@@ -1,4 +1,103 @@
-import pygame
+import bisect, collections, os
+
+# pygame is only imported when it is needed, by the first window or image,
+# so that headless tools start fast
+
+_icons = {} # (icon_file, size) -> pygame.Surface, shared by all Actors
+_decoded = {} # icon_file -> the Future of its decoded image
+_loader = None # the threads decoding images in the background, started when first needed
+LOADER_THREADS = 4
+
+# the keys that move a KeyboardPlayer -> the direction (dx, dy) of the move,
+# these are pygame's key codes pygame.K_w, pygame.K_a, ...
+KEY_MOVES = {ord('w'): (0, -1), # North
+             ord('a'): (-1, 0), # West
+             ord('s'): (0, 1), # South
+             ord('d'): (1, 0), # East
+             ord('q'): (-1, -1), # NorthWest
+             ord('e'): (1, -1), # NorthEast
+             ord('z'): (-1, 1), # SouthWest
+             ord('c'): (1, 1)} # SouthEast
+
+# the offsets of the 8 neighbours of a cell
+_NEIGHBOURS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+# bytes.translate table: 0 stays 0, anything else becomes 1
+_OCCUPIED = bytes([0]) + bytes([1]) * 255
+
+def preload_icon(icon_file):
+    '''
+    (str) -> None
+    Start decoding the image stored in icon_file in a background thread,
+    unless that was already started. load_icon then waits for it instead
+    of decoding the file again.
+    '''
+
+    global _loader
+    if icon_file in _decoded:
+        return
+    if _loader is None:
+        import concurrent.futures
+        _loader = concurrent.futures.ThreadPoolExecutor(LOADER_THREADS, 'ww-icons')
+    import pygame
+    _decoded[icon_file] = _loader.submit(pygame.image.load, icon_file)
+
+def icon_ready(icon_file):
+    '''
+    (str) -> bool
+    Return True iff load_icon can return the image in icon_file without
+    waiting for it to be decoded.
+    '''
+
+    future = _decoded.get(icon_file)
+    return future is not None and future.done()
+
+def _forget_loader():
+    '''
+    () -> None
+    In a child process, drop the threads of the parent, which do not run
+    there, and the images they had not decoded yet.
+    '''
+
+    global _loader
+    _loader = None
+    for icon_file, future in list(_decoded.items()):
+        if not future.done():
+            del _decoded[icon_file]
+
+if hasattr(os, 'register_at_fork'): # not on Windows, which does not fork
+    os.register_at_fork(after_in_child=_forget_loader)
+
+def load_icon(icon_file, size=None):
+    '''
+    (str, tuple of two ints) -> pygame.Surface
+    Return the image stored in icon_file, scaled to size if one is given.
+    Each file is only decoded once, later calls return the same Surface.
+    If preload_icon started decoding it, wait for that to finish.
+    If a display has been opened, the image is converted to its pixel format.
+    '''
+
+    key = (icon_file, size)
+    icon = _icons.get(key)
+    if icon is None:
+        import pygame
+        future = _decoded.get(icon_file)
+        if future is None:
+            import concurrent.futures
+            future = _decoded[icon_file] = concurrent.futures.Future()
+            try:
+                future.set_result(pygame.image.load(icon_file))
+            except Exception as e:
+                future.set_exception(e)
+        icon = future.result()
+        if pygame.display.get_surface() is not None:
+            if icon.get_flags() & pygame.SRCALPHA:
+                icon = icon.convert_alpha()
+            else:
+                icon = icon.convert()
+        if size is not None and icon.get_size() != size:
+            icon = pygame.transform.scale(icon, size)
+        _icons[key] = icon
+    return icon
 
 class Actor:
     '''
@@ -6,6 +105,9 @@ class Actor:
     Any object in the game's grid that appears on the stage, and has an
     x- and y-coordinate.
     '''
+
+    # there are a lot of Actors on a big stage, so they do without a __dict__
+    __slots__ = ('_icon_file', '_stage', '_seq', '_x', '_y', '_delay', '_delay_count')
     
     def __init__(self, icon_file, stage, x, y, delay=5):
         '''
@@ -16,9 +118,11 @@ class Actor:
         update, construct an Actor object.
         '''
         
-        self._icon = pygame.image.load(icon_file) # the image image to display of self
-        self.set_position(x, y) # self's location on the stage
+        self._icon_file = icon_file # the file with the image to display of self
+        stage.preload_icon(icon_file) # start decoding it, the image is shared with other Actors
         self._stage = stage # the stage that self is on
+        self._seq = None # self's place in the stage's actor order, None while off stage
+        self.set_position(x, y) # self's location on the stage
 
         # the following can be used to change this Actors 'speed' relative to other
         # actors speed. See the delay method.
@@ -29,8 +133,12 @@ class Actor:
         '''
         (Actor, int, int) -> None
         Set the position of this Actor to the given x- and y-coordinates.
+        If self is on a stage, the stage's index of occupied cells is updated.
         '''
         
+        if self._seq is not None:
+            self._stage._unplace(self, (self._x, self._y))
+            self._stage._place(self, (x, y))
         (self._x, self._y) = (x, y)
 
     def get_position(self):
@@ -47,7 +155,7 @@ class Actor:
         Return the image associated with this Actor.
         '''
         
-        return self._icon
+        return self._stage.load_icon(self._icon_file)
 
     def is_dead(self):
         '''
@@ -100,6 +208,8 @@ class Player(Actor):
     from the user, for example, key presses etc.
     '''
 
+    __slots__ = ()
+
     def __init__(self, icon_file, stage, x=0, y=0):
         '''
         (Player, str, Stage, int, int) -> None
@@ -120,62 +230,54 @@ class KeyboardPlayer(Player):
     '''
     A KeyboardPlayer is a Player that can handle keypress events.
     '''
+
+    __slots__ = ('_queue', '_moves_per_tick', '_dead')
     
-    def __init__(self, icon_file, stage, x=0, y=0):
+    def __init__(self, icon_file, stage, x=0, y=0, queue_size=8, moves_per_tick=1):
         '''
         Construct a KeyboardPlayer. Other than the given Player information,
-        a KeyboardPlayer also keeps track of the last key event that took place.
+        a KeyboardPlayer also keeps the key events that it has not acted
+        on yet, at most queue_size of them, and makes at most
+        moves_per_tick moves in a step.
         '''
         
         super().__init__(icon_file, stage, x, y)
-        self._last_event = None # we are only interested in the last event
+        self._queue = collections.deque(maxlen=queue_size) # keys not acted on yet, oldest first
+        self._moves_per_tick = moves_per_tick
+        self._dead = False # set when a Monster gets us
+
+    def is_dead(self):
+        '''
+        (KeyboardPlayer) -> bool
+        Return True iff this KeyboardPlayer was caught by a Monster.
+        '''
+
+        return self._dead
     
     def handle_event(self, event):
         '''
         (KeyboardPlayer, int) -> None
-        Record the last event directed at this KeyboardPlayer.
-        All previous events are ignored.
+        Record a key event directed at this KeyboardPlayer, to be acted on
+        in the coming steps. If too many are waiting, the oldest is dropped.
         '''
 
-        self._last_event = event
+        self._queue.append(event)
 
     def step(self):
         '''
         (KeyboardPlayer) -> None
         Take a single step in the animation. 
         For example: if the user asked us to move right, then we do that.
+        The waiting keys are acted on in the order they came, up to
+        moves_per_tick moves; keys that are not moves are skipped.
         '''
 
-        if self._last_event is not None:
-            dx, dy = None, None
-            # Movement toward South
-            if self._last_event == pygame.K_s:
-                dx, dy = 0,1
-            # Moverment toward North
-            if self._last_event == pygame.K_w:
-                dx, dy = 0,-1
-            # Movement toward East
-            if self._last_event == pygame.K_d:
-                dx, dy = 1,0
-            # Movement toward West
-            if self._last_event == pygame.K_a:
-                dx, dy = -1,0
-            # Diagonal Movement toward NorthWest
-            if self._last_event == pygame.K_q:
-                dx,dy = -1,-1
-            # Diagonal Movement toward NorthEast
-            if self._last_event == pygame.K_e:
-                dx,dy = 1,-1
-            # Diagonal Movement toward SouthEast
-            if self._last_event == pygame.K_c:
-                dx,dy = 1,1
-            # Diagonal Movement toward SouthWest
-            if self._last_event == pygame.K_z:
-                dx,dy = -1,1
-            if dx is not None and dy is not None:
-                self.move(self, dx, dy) # we are asking ourself to move
-
-            self._last_event = None
+        moves = 0
+        while self._queue and moves < self._moves_per_tick and self._seq is not None:
+            move = KEY_MOVES.get(self._queue.popleft())
+            if move is not None:
+                self.move(self, *move) # we are asking ourself to move
+                moves += 1
 
     def move(self, other, dx, dy):
         '''
@@ -191,24 +293,19 @@ class KeyboardPlayer(Player):
         new_x = self._x + dx
         new_y = self._y + dy
 
-        # FIX THIS ACCORDING TO LAB INSTRUCTIONS IN PART 1
-        # TODO: Check if (new_x, new_y) is on the stage.
-        #       If it is, then determine if another Actor is occupying that spot. If so,
-        #       self asks them to move. If they moved, then we can occupy the spot. Otherwise
-        #       we can't move. We return True if we moved and False otherwise.
-        if self._stage.is_in_bounds(new_x, new_y) and \
-           self._stage.get_actor(new_x,new_y) == None:
+        # If (new_x, new_y) is empty, we simply move there. If a Monster is
+        # there, it gets us. If a Box is there, we push it (and any Boxes
+        # behind it), and move if that made room.
+        actor = self._stage.get_actor(new_x, new_y)
+        if self._stage.is_in_bounds(new_x, new_y) and actor is None:
             super().move(other, dx, dy)
-        elif (self._stage.get_actor(new_x,new_y) != None) and self._stage and \
-             isinstance(self._stage.get_actor(new_x,new_y),Monster):
-            self.is_dead = True
+        elif isinstance(actor, Monster):
+            self._dead = True
             self._stage.remove_actor(self)
-        elif (self._stage.get_actor(new_x,new_y) != None) and self._stage and \
-             isinstance(self._stage.get_actor(new_x,new_y),Box):
-            self._stage.get_actor(new_x,new_y).move(self,dx,dy)
-            self._stage.get_actor(new_x,new_y)
-            if self._stage.get_actor(new_x,new_y) == None:
-                super().move(other,dx,dy)
+        elif isinstance(actor, Box):
+            self._stage.push(actor, dx, dy)
+            if self._stage.get_actor(new_x, new_y) is None:
+                super().move(other, dx, dy)
                 return True
             else:
                 return False
@@ -220,6 +317,8 @@ class Box(Actor):
     '''
     A Box Actor.
     '''
+
+    __slots__ = ()
     
     def __init__(self, icon_file, stage, x=0, y=0):
         '''
@@ -239,38 +338,19 @@ class Box(Actor):
         If a move is not possible, then return False.
         '''
         
-        new_x = self._x + dx
-        new_y = self._y + dy
-
-        # FIX THIS ACCORDING TO LAB INSTRUCTIONS IN PART 1
-        # TODO:
-        # If (new_x, new_y) is on the stage, and is empty, then 
-        # we simply move there. Otherwise, we ask whomever is at (new_x, new_y)
-        # to move, also the same direction. If they moved, the space is now
-        # empty, so we now move into (new_x, new_y). If we successfully
-        # moved, then we return True, otherwise, we return False. '''
-        if self._stage.is_in_bounds(new_x, new_y) and \
-           self._stage.get_actor(new_x,new_y) == None:
-            super().move(other,dx,dy) 
-        elif (self._stage.get_actor(new_x,new_y) != None) and self._stage \
-             and isinstance(self._stage.get_actor(new_x,new_y),Box):
-            self._stage.get_actor(new_x,new_y).move(self,dx,dy)
-            self._stage.get_actor(new_x, new_y)
-            if (self._stage.get_actor(new_x,new_y) == None):
-                super().move(other,dx,dy)
-                return True
-            else:
-                return False 
-        else:
-            return False
-
-        return True
+        # The whole line of Boxes in front of us is worked out by the stage.
+        return self._stage.push(self, dx, dy)
     
 # COMPLETE THIS CLASS FOR PART 2 OF LAB
 class Wall(Actor):
     '''
-    A Wall Actor
+    A Wall Actor.
+    Walls never move, so a Stage can also keep them in its terrain layer,
+    without a Wall object per cell: see Stage.add_wall.
     '''
+
+    __slots__ = ()
+
     def __init__(self, icon_file, stage, x=0, y=0):
         '''
         (Actor, str, Stage, int, int) -> None
@@ -283,23 +363,66 @@ class Stage:
     A Stage that holds all the game's Actors (Player, monsters, boxes, etc.).
     '''
     
-    def __init__(self, width, height, icon_dimension):
-        '''Construct a Stage with the given dimensions.'''
+    def __init__(self, width, height, icon_dimension, headless=False, icons=True, window=None):
+        '''
+        Construct a Stage with the given dimensions.
+        A headless Stage opens no window and draw does nothing, which is
+        what simulations and benchmarks want. Otherwise the window is opened
+        by open_window, or by the first draw. If icons is False, Actors on
+        this Stage get no image at all, so no image files are decoded; a
+        window then shows every actor as a grey square.
+        window is the (columns, rows) of cells the window shows, the whole
+        stage by default; a bigger stage is scrolled, see follow.
+        '''
         
         self._actors = [] # all actors on this stage (monsters, player, boxes, ...)
+        self._active = [] # the actors that do something when they step, in stage order
         self._player = None # a special actor, the player
 
+        # index of occupied cells: (x, y) -> the actor there, or a list of
+        # actors (in stage order) when several share the cell
+        self._cells = {}
+        self._next_seq = 0 # the order number given to the next added actor
+        self._cell_listeners = [] # called when a cell becomes occupied or empty
+        self._trap_listeners = [] # called when a Monster gets surrounded
+        self._actor_listeners = [] # called when an actor comes, goes or gets stuck in a sticky
+        self._changed = None # if a set, every actor placed or taken off a cell goes in it (see wwsnap)
+        self._flow_field = None # the FlowField shared by the Chasers, made when first needed
+        self._step_filter = None # if set, step only steps the actors it returns True for
+
         # the logical width and height of the stage
         self._width, self._height = width, height
 
+        # for each cell on the stage (row by row), how many of its 8
+        # neighbours are occupied
+        self._neighbours = bytearray(width * height)
+
+        # the terrain layer: for each cell (row by row), 0 or the kind of
+        # Wall built there by add_wall
+        self._terrain = bytearray(width * height)
+        self._walls = [None] # kind -> the Wall shared by all terrain of that kind
+        self._wall_kinds = {} # icon file -> kind
+
         self._icon_dimension=icon_dimension # the pixel dimension of all actors
-        # the pixel dimensions of the whole stage
-        self._pixel_width = self._icon_dimension * self._width
-        self._pixel_height = self._icon_dimension * self._height
+        # the pixel dimensions of the window, which shows at most the
+        # whole stage
+        (columns, rows) = window or (width, height)
+        self._pixel_width = self._icon_dimension * min(columns, self._width)
+        self._pixel_height = self._icon_dimension * min(rows, self._height)
         self._pixel_size = self._pixel_width, self._pixel_height
 
-        # get a screen of the appropriate dimension to draw on
-        self._screen = pygame.display.set_mode(self._pixel_size)
+        # the screen to draw on, None until the window is opened
+        self._screen = None
+        self._renderer = None
+        self._headless = headless
+        self._window = (columns, rows)
+        self._following = None # (actor, margin) the window follows, see follow
+        self._icons = icons
+
+        # cells whose contents changed since the last draw, only these
+        # are redrawn unless the whole screen needs to be redrawn
+        self._dirty = set()
+        self._redraw_all = True
 
     def is_in_bounds(self, x, y):
         '''
@@ -324,6 +447,63 @@ class Stage:
 
         return 0 <= y and y < self._height
 
+    def is_headless(self):
+        '''
+        (Stage) -> bool
+        Return True iff this Stage has no window to draw on.
+        '''
+
+        return self._headless
+
+    def open_window(self):
+        '''
+        (Stage) -> None
+        Open the window of this Stage, if it is not headless and the window
+        is not open yet. draw does it when needed; calling this first opens
+        it at a chosen time instead, for example while the images are
+        still being decoded.
+        '''
+
+        if self._headless or self._screen is not None:
+            return
+        import pygame
+        from wwrender import Renderer
+        self._screen = pygame.display.set_mode(self._pixel_size)
+        self._renderer = Renderer(self, self._screen, self._window)
+        if self._following is not None:
+            self._renderer.follow(*self._following)
+        self._redraw_all = True
+
+    def load_icon(self, icon_file, size=None):
+        '''
+        (Stage, str, tuple of two ints) -> pygame.Surface or None
+        Return the image in icon_file for an Actor on this Stage, scaled
+        to size if one is given, or None if this Stage does not use images.
+        '''
+
+        if not self._icons:
+            return None
+        return load_icon(icon_file, size)
+
+    def preload_icon(self, icon_file):
+        '''
+        (Stage, str) -> None
+        Start decoding the image in icon_file in the background, if this
+        Stage uses images.
+        '''
+
+        if self._icons:
+            preload_icon(icon_file)
+
+    def is_icon_ready(self, icon_file):
+        '''
+        (Stage, str) -> bool
+        Return True iff load_icon can return the image in icon_file
+        without waiting for it to be decoded.
+        '''
+
+        return not self._icons or icon_ready(icon_file)
+
     def get_width(self):
         '''
         (Stage) -> int
@@ -374,6 +554,12 @@ class Stage:
         '''
 
         self._actors.append(actor)
+        if type(actor).step is not Actor.step:
+            self._active.append(actor)
+        actor._seq = self._next_seq
+        self._next_seq += 1
+        self._place(actor, actor.get_position())
+        self._actor_changed(actor)
 
     def remove_actor(self, actor):
         '''
@@ -382,16 +568,396 @@ class Stage:
         '''
         
         self._actors.remove(actor)
+        if type(actor).step is not Actor.step:
+            self._active.remove(actor)
+        self._unplace(actor, actor.get_position())
+        actor._seq = None
+        self._actor_changed(actor)
+
+    def remove_actors(self, actors):
+        '''
+        (Stage, list of Actor) -> None
+        Remove all of actors from the Stage. This is what remove_actor does
+        for each of them, but the lists of actors are only gone through once.
+        '''
+
+        for actor in actors:
+            self._unplace(actor, actor.get_position())
+            actor._seq = None
+            self._actor_changed(actor)
+        self._actors = [a for a in self._actors if a._seq is not None]
+        self._active = [a for a in self._active if a._seq is not None]
+
+    def _insert(self, actor, seq):
+        '''
+        (Stage, Actor, int) -> None
+        Put actor, which was removed from this Stage, back on it in its
+        old place seq in the stage order.
+        '''
+
+        actor._seq = seq
+        lists = (self._actors, self._active) if type(actor).step is not Actor.step else (self._actors,)
+        for actors in lists:
+            actors.insert(bisect.bisect(actors, seq, key=lambda a: a._seq), actor)
+        self._place(actor, actor.get_position())
+        self._actor_changed(actor)
+
+    def _place(self, actor, cell):
+        '''
+        (Stage, Actor, tuple of two ints) -> None
+        Record in the cell index that actor occupies cell. Actors sharing
+        a cell are kept in the order they were added to this Stage.
+        '''
+
+        if self._screen is not None:
+            self._dirty.add(cell)
+        if self._changed is not None:
+            self._changed.add(actor)
+        occupant = self._cells.get(cell)
+        if occupant is None:
+            self._cells[cell] = actor
+            if not self.is_wall(*cell):
+                self._filled(cell)
+        elif type(occupant) is list:
+            i = len(occupant)
+            while i > 0 and occupant[i-1]._seq > actor._seq:
+                i -= 1
+            occupant.insert(i, actor)
+        elif occupant._seq < actor._seq:
+            self._cells[cell] = [occupant, actor]
+        else:
+            self._cells[cell] = [actor, occupant]
+
+    def _unplace(self, actor, cell):
+        '''
+        (Stage, Actor, tuple of two ints) -> None
+        Record in the cell index that actor no longer occupies cell.
+        '''
+
+        if self._screen is not None:
+            self._dirty.add(cell)
+        if self._changed is not None:
+            self._changed.add(actor)
+        occupant = self._cells[cell]
+        if occupant is actor:
+            del self._cells[cell]
+            if not self.is_wall(*cell):
+                self._emptied(cell)
+        else:
+            occupant.remove(actor)
+            if len(occupant) == 1:
+                self._cells[cell] = occupant[0]
+
+    def _filled(self, cell):
+        '''
+        (Stage, tuple of two ints) -> None
+        Update everything that depends on cell, which just became occupied.
+        '''
+
+        self._count_neighbours(cell, 1)
+        for listener in self._cell_listeners:
+            listener(cell[0], cell[1], True)
+        if self._trap_listeners and self.is_surrounded(*cell):
+            self._trapped(cell)
+
+    def _emptied(self, cell):
+        '''
+        (Stage, tuple of two ints) -> None
+        Update everything that depends on cell, which just became empty.
+        '''
+
+        self._count_neighbours(cell, -1)
+        for listener in self._cell_listeners:
+            listener(cell[0], cell[1], False)
+
+    def add_wall(self, icon_file, x, y):
+        '''
+        (Stage, str, int, int) -> None
+        Build a Wall with the image in icon_file at (x, y), which must be
+        on this Stage. Unlike a Wall added with add_actor, it is kept in
+        the terrain layer, one byte per cell, and get_actor returns a Wall
+        shared by all the terrain built with icon_file (its position is
+        meaningless). Building a Wall where there already is one replaces it.
+        '''
+
+        if not self.is_in_bounds(x, y):
+            raise ValueError('(%d, %d) is not on the stage' % (x, y))
+        kind = self._wall_kind(icon_file)
+        i = y * self._width + x
+        was_occupied = self._terrain[i] != 0 or (x, y) in self._cells
+        self._terrain[i] = kind
+        if self._screen is not None:
+            self._dirty.add((x, y))
+        if not was_occupied:
+            self._filled((x, y))
+
+    def _wall_kind(self, icon_file):
+        '''
+        (Stage, str) -> int
+        Return the kind of terrain Wall built with icon_file, making a new
+        kind if there is none yet.
+        '''
+
+        kind = self._wall_kinds.get(icon_file)
+        if kind is None:
+            if len(self._walls) == 256:
+                raise ValueError('a Stage can have at most 255 kinds of Wall')
+            kind = self._wall_kinds[icon_file] = len(self._walls)
+            self._walls.append(Wall(icon_file, self, -1, -1))
+        return kind
+
+    def remove_wall(self, x, y):
+        '''
+        (Stage, int, int) -> None
+        Remove the Wall built by add_wall at (x, y), if there is one.
+        '''
+
+        if not self.is_wall(x, y):
+            return
+        self._terrain[y * self._width + x] = 0
+        if self._screen is not None:
+            self._dirty.add((x, y))
+        if (x, y) not in self._cells:
+            self._emptied((x, y))
+
+    def is_wall(self, x, y):
+        '''
+        (Stage, int, int) -> bool
+        Return True iff add_wall built a Wall at (x, y).
+        '''
+
+        return 0 <= x < self._width and 0 <= y < self._height and \
+               self._terrain[y * self._width + x] != 0
+
+    def populate(self, terrain, wall_icons, actors=(), player=None):
+        '''
+        (Stage, bytes, list of str, list of Actor, Player) -> None
+        Fill this Stage, which must be empty, in one go. terrain is the
+        whole terrain layer, one byte per cell row by row: 0 or a kind of
+        Wall, built with the icon file wall_icons[kind-1]. The actors are
+        then added in order, and player, which must be one of them, is
+        made the player.
+
+        This is what add_wall and add_actor would do, but the counts of
+        occupied neighbours are worked out for all cells at once, which
+        makes it the way to set up a big board. Listeners are not told
+        about the cells that get filled.
+        '''
+
+        width, height = self._width, self._height
+        if len(terrain) != width * height:
+            raise ValueError('terrain has %d cells, the stage has %d'
+                             % (len(terrain), width * height))
+        if self._actors or self._terrain.count(0) != len(self._terrain):
+            raise ValueError('only an empty Stage can be populated')
+
+        # kinds of the terrain -> kinds of this stage, kinds without an icon are left empty
+        kinds = bytearray(256)
+        for kind, icon_file in enumerate(wall_icons, 1):
+            kinds[kind] = self._wall_kind(icon_file)
+        self._terrain[:] = bytes(terrain).translate(kinds)
+
+        # which cells are occupied, with a ring of cells around the stage
+        # since actors there are next to cells on it
+        row = width + 2
+        occupied = bytearray(row * (height + 2))
+        filled = self._terrain.translate(_OCCUPIED)
+        for y in range(height):
+            occupied[(y+1)*row + 1:(y+1)*row + 1 + width] = filled[y*width:(y+1)*width]
+
+        for actor in actors:
+            self._actors.append(actor)
+            if type(actor).step is not Actor.step:
+                self._active.append(actor)
+            actor._seq = self._next_seq
+            self._next_seq += 1
+            cell = (x, y) = actor.get_position()
+            occupant = self._cells.get(cell)
+            if occupant is None:
+                self._cells[cell] = actor
+            elif type(occupant) is list:
+                occupant.append(actor)
+            else:
+                self._cells[cell] = [occupant, actor]
+            if -1 <= x <= width and -1 <= y <= height:
+                occupied[(y+1)*row + x+1] = 1
+        if player is not None:
+            self._player = player
+
+        # Read as one big number with a digit per cell, the occupied grid
+        # shifted by a neighbour's offset lines every cell up with that
+        # neighbour. A cell has at most 8 neighbours, so adding the 8
+        # shifted grids never carries from one digit into the next.
+        grid = int.from_bytes(occupied, 'big')
+        total = 0
+        for (dx, dy) in _NEIGHBOURS:
+            shift = 8 * (dy * row + dx)
+            total += grid << shift if shift > 0 else grid >> -shift
+        total &= (1 << 8 * len(occupied)) - 1 # drop what was shifted off the top
+        counts = total.to_bytes(len(occupied), 'big')
+        self._neighbours[:] = b''.join(counts[(y+1)*row + 1:(y+1)*row + 1 + width]
+                                       for y in range(height))
+        self._redraw_all = True
+
+    def _count_neighbours(self, cell, change):
+        '''
+        (Stage, tuple of two ints, int) -> None
+        Add change to the count of occupied neighbours of every cell
+        around cell, which just became occupied (1) or empty (-1).
+        '''
+
+        (x, y) = cell
+        width, height = self._width, self._height
+        counts = self._neighbours
+        for (dx, dy) in _NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+                i = ny * width + nx
+                counts[i] += change
+                if counts[i] == 8 and self._trap_listeners:
+                    self._trapped((nx, ny))
+
+    def _trapped(self, cell):
+        '''
+        (Stage, tuple of two ints) -> None
+        Tell the trap listeners about every Monster in cell, which has
+        just been surrounded.
+        '''
+
+        occupant = self._cells.get(cell)
+        for a in (occupant if type(occupant) is list else (occupant,)):
+            if isinstance(a, Monster):
+                for listener in self._trap_listeners:
+                    listener(a)
+
+    def is_surrounded(self, x, y):
+        '''
+        (Stage, int, int) -> bool
+        Return True iff all 8 cells around (x, y) are occupied.
+        '''
+
+        if self.is_in_bounds(x, y):
+            return self._neighbours[y * self._width + x] == 8
+        for (dx, dy) in _NEIGHBOURS:
+            if self.get_actor(x + dx, y + dy) is None:
+                return False
+        return True
+
+    def add_trap_listener(self, listener):
+        '''
+        (Stage, function) -> None
+        Arrange for listener(monster) to be called the moment a Monster on
+        this Stage gets surrounded, that is when its 8th neighbour is filled.
+        '''
+
+        self._trap_listeners.append(listener)
+
+    def add_cell_listener(self, listener):
+        '''
+        (Stage, function) -> None
+        Arrange for listener(x, y, occupied) to be called whenever the cell
+        (x, y) becomes occupied (occupied is True) or empty (occupied is False).
+        '''
+
+        self._cell_listeners.append(listener)
+
+    def add_actor_listener(self, listener):
+        '''
+        (Stage, function) -> None
+        Arrange for listener(actor) to be called whenever actor is added
+        to or removed from this Stage, or gets stuck inside a sticky.
+        '''
+
+        self._actor_listeners.append(listener)
+
+    def _actor_changed(self, actor):
+        '''
+        (Stage, Actor) -> None
+        Tell the actor listeners about actor.
+        '''
+
+        for listener in self._actor_listeners:
+            listener(actor)
+
+    def get_flow_field(self):
+        '''
+        (Stage) -> FlowField
+        Return the FlowField towards the player that all the Chasers on
+        this Stage share, making it the first time it is asked for.
+        '''
+
+        if self._flow_field is None:
+            self._flow_field = FlowField(self)
+        return self._flow_field
 
     def step(self):
         '''
         (Stage) -> None
         Take one step in the animation of the game. 
         Do this by asking each of the actors on this Stage to take a single step.
+        Actors removed during the step, by themselves or others, are not stepped.
+        Actors whose step does nothing (Walls, Boxes, ...) are skipped, and
+        so are the ones the step filter leaves out (see set_step_filter).
         '''
 
-        for a in self._actors:
-            a.step()
+        keep = self._step_filter
+        if keep is None:
+            for a in list(self._active):
+                if a._seq is not None:
+                    a.step()
+        else:
+            for a in list(self._active):
+                if a._seq is not None and keep(a):
+                    a.step()
+
+    def set_step_filter(self, keep):
+        '''
+        (Stage, function) -> None
+        Make step only step the actors a for which keep(a) is True, or
+        all of them again if keep is None.
+        '''
+
+        self._step_filter = keep
+
+    def push(self, box, dx, dy):
+        '''
+        (Stage, Box, int, int) -> bool
+        Push box in direction (dx, dy), along with the line of Boxes in
+        front of it, and return True iff box moved.
+
+        The line is scanned once. It can move if the cell past its last Box
+        is an empty cell on the stage, or if the last Box is a sticky and
+        that cell holds a Monster, which the sticky then moves onto and
+        traps. The Boxes are then moved starting from the far end, each
+        one only if the cell in front of it was emptied.
+        '''
+
+        line = [box]
+        (x, y) = box.get_position()
+        while True:
+            x, y = x + dx, y + dy
+            ahead = self.get_actor(x, y)
+            if isinstance(line[-1], sticky) and isinstance(ahead, Monster):
+                break
+            if isinstance(ahead, Box):
+                line.append(ahead)
+            elif ahead is None and self.is_in_bounds(x, y):
+                break
+            else:
+                return False # the line is stuck
+
+        last = line.pop()
+        last.set_position(x, y)
+        actor = self.get_actor(x, y)
+        if isinstance(last, sticky) and isinstance(actor, Monster):
+            actor.inside_sticky = True
+            self._actor_changed(actor)
+        for b in reversed(line):
+            x, y = x - dx, y - dy
+            if self.get_actor(x, y) is not None: # something else was in the way
+                return False
+            b.set_position(x, y)
+        return True
 
     def get_actors(self):
         '''
@@ -404,32 +970,212 @@ class Stage:
     def get_actor(self, x, y):
         '''
         (Stage, int, int) -> Actor or None
-        Return the first actor at coordinates (x,y).
+        Return the first actor at coordinates (x,y), a Wall from the
+        terrain layer coming after all the Actors there.
         Or, return None if there is no Actor in that position.
         '''
         
-        for a in self._actors:
-            if a.get_position() == (x,y):
-                return a
-        return None
+        occupant = self._cells.get((x, y))
+        if occupant is None:
+            if 0 <= x < self._width and 0 <= y < self._height:
+                return self._walls[self._terrain[y * self._width + x]]
+            return None
+        if type(occupant) is list:
+            return occupant[0]
+        return occupant
 
     def draw(self):
         '''
         (Stage) -> None
         Draw all Actors that are part of this Stage to the screen.
+        The whole screen is only drawn the first time (or after refresh),
+        after that only the cells whose contents changed are redrawn.
+        The drawing itself is done by a wwrender.Renderer.
         '''
         
-        self._screen.fill((0,0,0)) # (0,0,0)=(r,g,b)=black
-        for a in self._actors:
-            icon = a.get_icon()
-            (x,y) = a.get_position()
-            d = self._icon_dimension
-            rect = pygame.Rect(x*d, y*d, d, d)
-            self._screen.blit(icon, rect)
-        pygame.display.flip()
+        if self._headless:
+            return
+        if self._screen is None:
+            self.open_window()
+        if self._redraw_all:
+            self._renderer.refresh()
+            self._redraw_all = False
+        self._renderer.draw(self._dirty)
+        self._dirty.clear()
+
+    def refresh(self):
+        '''
+        (Stage) -> None
+        Make the next draw redraw the whole screen, for example after the
+        window was covered up.
+        '''
+
+        self._redraw_all = True
+
+    def follow(self, actor, margin=3):
+        '''
+        (Stage, Actor, int) -> None
+        Make the window scroll with actor, keeping it at least margin cells
+        away from the edges of the window where the stage allows.
+        '''
+
+        self._following = (actor, margin)
+        if self._renderer is not None:
+            self._renderer.follow(actor, margin)
         
+class StageWrapper:
+    '''
+    Stands in for a Stage wherever one is stepped (for example, given to a
+    GameLoop), passing everything on to it. Subclasses override what they
+    do differently.
+    '''
+
+    def __init__(self, stage):
+        '''
+        (StageWrapper, Stage) -> None
+        Construct a StageWrapper for stage.
+        '''
+
+        self._stage = stage
+
+    def player_event(self, event):
+        '''
+        (StageWrapper, int) -> None
+        Send a key to the player of the stage.
+        '''
+
+        self._stage.player_event(event)
+
+    def step(self):
+        '''
+        (StageWrapper) -> None
+        Step the stage.
+        '''
+
+        self._stage.step()
+
+    def draw(self):
+        '''
+        (StageWrapper) -> None
+        Draw the stage.
+        '''
+
+        self._stage.draw()
+
+    def refresh(self):
+        '''
+        (StageWrapper) -> None
+        Make the next draw of the stage redraw the whole screen.
+        '''
+
+        self._stage.refresh()
+
+class GameLoop:
+    '''
+    Runs a Stage. The simulation steps at a fixed number of ticks per second
+    no matter how long drawing takes, while the screen is drawn at its own,
+    independent, frame rate. Since every Stage.step is one tick, the delay
+    of each Actor means the same thing at any frame rate.
+    '''
+
+    def __init__(self, stage, tick_rate=10, frame_rate=60, max_catch_up=5, key_repeat=None):
+        '''
+        (GameLoop, Stage, int, int, int, tuple of two ints) -> None
+        Construct a GameLoop that steps stage tick_rate times a second and
+        draws it at most frame_rate times a second (0 means as often as
+        possible). If drawing falls behind, at most max_catch_up ticks
+        are run before the next frame, the rest of the backlog is dropped.
+        If key_repeat is (delay, interval), a move key held down for delay
+        ticks is sent to the player again, and then every interval ticks.
+        '''
+
+        self._stage = stage
+        self._tick_ms = 1000 / tick_rate # the simulation time of a tick
+        self._frame_rate = frame_rate
+        self._max_catch_up = max_catch_up
+        self._key_repeat = key_repeat
+        self._held = None # the move key held down, if any
+        self._held_ticks = 0 # for how many ticks it has been held
+        self._running = False
+
+    def handle_event(self, event):
+        '''
+        (GameLoop, pygame.event.Event) -> None
+        React to a pygame event: quit, pass key presses to the player,
+        or redraw the screen if it was exposed.
+        '''
+
+        import pygame
+        if event.type == pygame.QUIT:
+            self.stop()
+        elif event.type == pygame.KEYDOWN:
+            self._stage.player_event(event.key)
+        elif event.type == pygame.VIDEOEXPOSE:
+            self._stage.refresh()
+
+    def repeat_keys(self):
+        '''
+        (GameLoop) -> None
+        Called before every tick: if a move key is being held down, send
+        it to the player again as key_repeat asks. The keys go through
+        Stage.player_event like key presses, so recordings see them too.
+        '''
+
+        if self._key_repeat is None:
+            return
+        import pygame
+        pressed = pygame.key.get_pressed()
+        key = next((key for key in KEY_MOVES if pressed[key]), None)
+        if key != self._held:
+            self._held, self._held_ticks = key, 0
+            return
+        if key is None:
+            return
+        self._held_ticks += 1
+        (delay, interval) = self._key_repeat
+        if self._held_ticks >= delay and (self._held_ticks - delay) % interval == 0:
+            self._stage.player_event(key)
+
+    def stop(self):
+        '''
+        (GameLoop) -> None
+        Make run return after the current frame.
+        '''
+
+        self._running = False
+
+    def run(self):
+        '''
+        (GameLoop) -> None
+        Step and draw the stage until stop is called.
+        The time since the last frame is added to an accumulator and one
+        tick is run for every tick's worth of time in it.
+        '''
+
+        import pygame
+        clock = pygame.time.Clock()
+        lag = 0.0 # simulation time owed, in milliseconds
+        self._running = True
+        while self._running:
+            lag += clock.tick(self._frame_rate)
+            for event in pygame.event.get():
+                self.handle_event(event)
+
+            ticks = 0
+            while lag >= self._tick_ms and ticks < self._max_catch_up:
+                self.repeat_keys()
+                self._stage.step()
+                lag -= self._tick_ms
+                ticks += 1
+            if lag >= self._tick_ms: # too far behind, don't try to catch up
+                lag %= self._tick_ms
+
+            self._stage.draw()
+
 class Monster(Actor):
     '''A Monster class.'''
+
+    __slots__ = ('_dx', '_dy', 'inside_sticky')
     
     def __init__(self, icon_file, stage, x=0, y=0, delay=5):
         '''Construct a Monster.'''
@@ -476,8 +1222,6 @@ class Monster(Actor):
         new_x = self._x + self._dx
         new_y = self._y + self._dy
 
-        dead = self.is_dead()
-
         if self.inside_sticky:
             pass
 
@@ -486,7 +1230,7 @@ class Monster(Actor):
 
             if isinstance(actor, KeyboardPlayer):
                 self._stage.remove_actor(actor)
-                actor.is_dead = True
+                actor._dead = True
                 
             if not self._stage.is_in_bounds_x(new_x) or actor != None: 
                 self._dx=-self._dx
@@ -509,54 +1253,266 @@ class Monster(Actor):
         other Monsters.
         '''
 
-        # TODO: This is part of the assignment and not yet required for the lab.
-        # If you have extra time in lab, feel free to get working on this.
-
-        dead = False
-        position = self.get_position()
-        x_val = position[0]
-        y_val = position[1]
-
-        cord1 = self._stage.get_actor(x_val+1, y_val)
-        cord2 = self._stage.get_actor(x_val-1, y_val)
-        cord3 = self._stage.get_actor(x_val, y_val+1)
-        cord4 = self._stage.get_actor(x_val, y_val-1)
-        cord5 = self._stage.get_actor(x_val+1, y_val+1)
-        cord6 = self._stage.get_actor(x_val-1, y_val-1)
-        cord7 = self._stage.get_actor(x_val+1, y_val-1)
-        cord8 = self._stage.get_actor(x_val-1, y_val+1)
-        
-        if (cord1 and cord2 and cord3 and cord4 and \
-            cord5 and cord6 and cord7 and cord8):
-
-            dead = True
-            Actor.is_dead = True
-            
-        return dead
+        return self._stage.is_surrounded(self._x, self._y)
 
 class sticky(Box):
     '''
     A special box that if a monster is in it then the monster is stuck
-    at that position on the stage. 
+    at that position on the stage. It moves like a Box, except that when
+    pushed onto a Monster it moves onto it (see Stage.push).
     '''
 
+    __slots__ = ()
+
     def __init__(self, icon_file, stage, x = 0, y = 0):
         '''
         (Actor, str, Stage, int, int) -> None
         Make a sticky box on the stage
         '''
         Box.__init__(self, icon_file, stage, x, y)
+            
+
+class Chaser(Monster):
+    '''
+    A Monster that chases the player. Each time it moves, it takes the
+    step that the FlowField of its Stage says brings it closest to the
+    player. Where the field does not reach, or no empty cell around it is
+    closer, it keeps going in its direction and bounces like a Monster.
+    '''
 
-    def move(self,other,dx,dy):
+    __slots__ = ()
+
+    def step(self):
         '''
-        (Actor, Actor, int, int) -> bool
+        Take one step in the animation (this Chaser moves by one space,
+        towards the player if it can). If it's being delayed, return None.
+        Else, return True.
         '''
-        new_x = self._x + dx
-        new_y = self._y + dy
 
-        if isinstance(self._stage.get_actor(new_x,new_y), Monster):
-            Actor.move(self,other,dx,dy)
-            self._stage.get_actor(new_x,new_y).inside_sticky = True
-        else:
-            Box.move(self,other,dx,dy)
-            
+        if self.is_dead():
+            self._stage.remove_actor(self)
+
+        if not self.delay() and not self.inside_sticky: return
+        if not self.inside_sticky:
+            move = self._stage.get_flow_field().direction(self._x, self._y)
+            if move is not None:
+                self._dx, self._dy = move
+        self.move(self, self._dx, self._dy)
+        return True
+
+class FlowField:
+    '''
+    The number of moves from each cell around the player of a Stage to the
+    player, shared by all the Chasers of the Stage, so that each of them
+    finds its way in O(1) instead of searching on its own.
+
+    The moves are the 8 ways a Monster moves, through cells that are empty
+    or hold a Monster or the player. The cells are found breadth first
+    from the player, up to reach moves away. Where the player can not be
+    reached within reach moves there is no distance, and Chasers there
+    bounce about like Monsters.
+
+    The search is only done again when asked for a direction after the
+    player moved. After a cell the distances went through got something
+    other than a Monster or the player in it, or a cell found blocked was
+    emptied, the distances are repaired instead: only the cells whose
+    distance no longer follows from a neighbour's are worked out again,
+    and only the distances that change are passed on, so a Box pushed
+    about costs about the cells behind it. A move of the player changes
+    the distances of about half the cells, which a search finds faster
+    than a repair would. Changes anywhere else, such as the Monsters
+    moving about, do not change the distances.
+    '''
+
+    def __init__(self, stage, reach=32):
+        '''
+        (FlowField, Stage, int) -> None
+        Construct the field towards the player of stage, reaching at
+        most reach moves away from the player.
+        '''
+
+        self._stage = stage
+        self._reach = reach
+        self._origin = None # the player's cell the distances are from, None if it is not on the stage
+        self._distances = {} # cell -> the number of moves from it to the player
+        self._blocked = set() # cells next to the distances that can not be gone through
+        self._closed = [] # cells of the distances that got something in them since the last update
+        self._opened = [] # blocked cells that were emptied since the last update
+        self._stale = True # the distances must be searched from scratch
+        self.searches = 0 # the number of searches done, for benchmarks
+        self.repairs = 0 # the number of repairs done, for benchmarks
+        stage.add_cell_listener(self._cell_changed)
+
+    def _cell_changed(self, x, y, occupied):
+        '''
+        (FlowField, int, int, bool) -> None
+        Called by the stage when (x, y) becomes occupied or empty: note
+        if that changes the distances.
+        '''
+
+        if self._stale:
+            return
+        cell = (x, y)
+        if occupied:
+            if cell in self._distances and \
+               not isinstance(self._stage.get_actor(x, y), (Monster, Player)):
+                self._closed.append(cell)
+        elif cell in self._blocked:
+            self._opened.append(cell)
+
+    def _update(self):
+        '''
+        (FlowField) -> None
+        Search or repair the distances if they may have changed.
+        '''
+
+        player = self._stage._player
+        origin = None
+        if player is not None and player._seq is not None:
+            origin = player.get_position()
+        if self._stale or origin != self._origin:
+            self._search(origin)
+        elif self._closed or self._opened:
+            self._repair()
+
+    def _search(self, origin):
+        '''
+        (FlowField, tuple of two ints) -> None
+        Find the distances of the cells within reach of origin, breadth
+        first. There are none if origin is None.
+        '''
+
+        self._origin = origin
+        self._stale = False
+        self._closed, self._opened = [], []
+        self.searches += 1
+        distances = self._distances = {}
+        blocked = self._blocked = set()
+        if origin is None or not self._stage.is_in_bounds(*origin):
+            return
+        get_actor = self._stage.get_actor
+        width, height = self._stage.get_width(), self._stage.get_height()
+        distances[origin] = 0
+        frontier = [origin]
+        for d in range(1, self._reach + 1):
+            found = []
+            for (x, y) in frontier:
+                for (dx, dy) in _NEIGHBOURS:
+                    cell = (nx, ny) = (x + dx, y + dy)
+                    if cell in distances or cell in blocked:
+                        continue
+                    if not (0 <= nx < width and 0 <= ny < height):
+                        continue
+                    actor = get_actor(nx, ny)
+                    if actor is None or isinstance(actor, (Monster, Player)):
+                        distances[cell] = d
+                        found.append(cell)
+                    else:
+                        blocked.add(cell)
+            if not found:
+                break
+            frontier = found
+
+    def _repair(self):
+        '''
+        (FlowField) -> None
+        Bring the distances up to date with the cells closed and opened
+        since the last update. First the cells that lost the neighbour
+        one move closer that their distance came from are dropped, and so
+        on outwards; then the distances are passed on, nearest first,
+        from the neighbours of the dropped cells and from the opened
+        cells, to the cells that they bring closer.
+        '''
+
+        self.repairs += 1
+        get_actor = self._stage.get_actor
+        width, height = self._stage.get_width(), self._stage.get_height()
+        distances, blocked, reach = self._distances, self._blocked, self._reach
+        check = [] # cells that may have lost the neighbour their distance came from
+        for (x, y) in self._closed:
+            actor = get_actor(x, y)
+            if (x, y) in distances and actor is not None and \
+               not isinstance(actor, (Monster, Player)):
+                del distances[(x, y)]
+                blocked.add((x, y))
+                check.extend((x + dx, y + dy) for (dx, dy) in _NEIGHBOURS)
+        opened = []
+        for (x, y) in self._opened:
+            actor = get_actor(x, y)
+            if (x, y) in blocked and (actor is None or isinstance(actor, (Monster, Player))):
+                blocked.discard((x, y))
+                opened.append((x, y))
+        self._closed, self._opened = [], []
+
+        dropped = []
+        while check:
+            cell = check.pop()
+            d = distances.get(cell)
+            if not d: # not in the distances, or the player's cell
+                continue
+            (x, y) = cell
+            for (dx, dy) in _NEIGHBOURS:
+                if distances.get((x + dx, y + dy)) == d - 1:
+                    break
+            else:
+                del distances[cell]
+                dropped.append(cell)
+                check.extend(n for n in ((x + dx, y + dy) for (dx, dy) in _NEIGHBOURS)
+                             if distances.get(n) == d + 1)
+
+        nearest = [[] for d in range(reach + 1)] # the cells to pass the distance d on from
+        for (x, y) in dropped + opened:
+            d = min((distances.get((x + dx, y + dy), reach) for (dx, dy) in _NEIGHBOURS)) + 1
+            if d <= reach and d < distances.get((x, y), reach + 1):
+                distances[(x, y)] = d
+                nearest[d].append((x, y))
+
+        for d in range(reach):
+            for (x, y) in nearest[d]:
+                if distances.get((x, y)) != d:
+                    continue # it was brought closer since
+                for (dx, dy) in _NEIGHBOURS:
+                    cell = (nx, ny) = (x + dx, y + dy)
+                    old = distances.get(cell)
+                    if old is None:
+                        if cell in blocked or not (0 <= nx < width and 0 <= ny < height):
+                            continue
+                        actor = get_actor(nx, ny)
+                        if actor is not None and not isinstance(actor, (Monster, Player)):
+                            blocked.add(cell)
+                            continue
+                    elif old <= d + 1:
+                        continue
+                    distances[cell] = d + 1
+                    nearest[d + 1].append(cell)
+
+    def distance(self, x, y):
+        '''
+        (FlowField, int, int) -> int or None
+        Return the number of moves from (x, y) to the player, or None if
+        the player can not be reached from there within reach moves.
+        '''
+
+        self._update()
+        return self._distances.get((x, y))
+
+    def direction(self, x, y):
+        '''
+        (FlowField, int, int) -> tuple of two ints or None
+        Return the direction (dx, dy) of a move from (x, y) to an empty
+        cell, or to the player, that is closer to the player than (x, y),
+        the closest such cell if there are several. Return None if there
+        is no such move.
+        '''
+
+        self._update()
+        distances = self._distances
+        best = distances.get((x, y), self._reach + 1)
+        move = None
+        for (dx, dy) in _NEIGHBOURS:
+            d = distances.get((x + dx, y + dy))
+            if d is not None and d < best:
+                actor = self._stage.get_actor(x + dx, y + dy)
+                if actor is None or actor is self._stage._player:
+                    best, move = d, (dx, dy)
+        return move
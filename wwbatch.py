@@ -0,0 +1,390 @@
+'''
+Play many independent games at once, with NumPy.
+
+A Batch holds N boards of the same size in stacked arrays: for every
+board and cell, the kind of the first thing there (what Stage.get_actor
+would return) and the number of stickies in it, and for every board the
+player and M Monster slots. Batch.step takes one move per board and
+advances every board by one tick, exactly like Stage.step would: the
+player moves (pushing Boxes) and then the Monsters step one slot after
+another, each slot for all boards at once.
+
+    batch = Batch.generate(wwgame.BOARD, 20, 20, seeds=range(10000))
+    while not batch.done.all():
+        batch.step(policy(batch)) # one index into DIRECTIONS per board
+
+The boards must be laid out like wwgen makes them: the player first in
+the stage order, then the Monsters, and the stickies after all the
+Monsters. A board stops changing once it is done, that is once its
+player was caught (dead) or all its Monsters died (won).
+
+simulate plays random games and only needs picklable arguments, so it
+can be handed to a multiprocessing.Pool.
+'''
+
+import time
+
+import numpy as np
+
+import ww, wwgen
+
+# kinds of cell, by the first thing in it
+EMPTY, WALL, BOX, STICKY, PLAYER, MONSTER = range(6)
+
+# the moves of the player: 0 is no move
+DIRECTIONS = np.array([(0, 0), (0, -1), (-1, 0), (0, 1), (1, 0),
+                       (-1, -1), (1, -1), (-1, 1), (1, 1)], np.int64)
+KEY_DIRECTIONS = {key: DIRECTIONS.tolist().index(list(move))
+                  for key, move in ww.KEY_MOVES.items()}
+
+PAD = 3 # rows kept above and below the stage, Monsters can stray into them
+NEIGHBOURS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dx, dy) != (0, 0)]
+
+class Batch:
+    '''
+    N independent boards of the same size, stepped together.
+    '''
+
+    def __init__(self, n, width, height, monsters):
+        '''
+        (Batch, int, int, int, int) -> None
+        Construct a Batch of n empty width by height boards, each with
+        room for monsters Monsters and no player. Use from_stages or
+        generate to fill it.
+        '''
+
+        self._n, self._width, self._height = n, width, height
+        # Monsters can also stray left and right of the stage, as far as
+        # they like, so the columns kept on each side (ox) grow as needed
+        self._ox = PAD
+        shape = (n, height + 2*PAD, width + 2*self._ox)
+        self.kind = np.zeros(shape, np.int8) # the kind of the first thing in each cell
+        self.stickies = np.zeros(shape, np.uint8) # the number of stickies in each cell
+        self.slot = np.full(shape, -1, np.int16) # the Monster slot in each cell, or -1
+
+        self.player_x = np.zeros(n, np.int64)
+        self.player_y = np.zeros(n, np.int64)
+        self.has_player = np.zeros(n, bool) # the player is on the board
+        self.dead = np.zeros(n, bool) # the player was caught
+
+        shape = (n, monsters)
+        self.monster_x = np.zeros(shape, np.int64)
+        self.monster_y = np.zeros(shape, np.int64)
+        self.monster_dx = np.ones(shape, np.int64)
+        self.monster_dy = np.ones(shape, np.int64)
+        self.monster_delay = np.ones(shape, np.int64)
+        self.monster_count = np.zeros(shape, np.int64)
+        self.alive = np.zeros(shape, bool) # the Monster is on the board
+        self.inside_sticky = np.zeros(shape, bool)
+
+        self.ticks = np.zeros(n, np.int64) # ticks each board was stepped
+
+    @classmethod
+    def from_stages(cls, stages):
+        '''
+        (list of Stage) -> Batch
+        Return a Batch holding copies of stages, which must all have the
+        same size and be laid out as described in the module docstring.
+        '''
+
+        width, height = stages[0].get_width(), stages[0].get_height()
+        monsters = max(sum(type(a) is ww.Monster for a in s.get_actors()) for s in stages)
+        batch = cls(len(stages), width, height, monsters)
+        for b, stage in enumerate(stages):
+            if (stage.get_width(), stage.get_height()) != (width, height):
+                raise ValueError('all the stages of a Batch must have the same size')
+            batch._copy(b, stage)
+        return batch
+
+    @classmethod
+    def generate(cls, spec, width, height, seeds):
+        '''
+        (dict, int, int, list of int) -> Batch
+        Return a Batch of the boards wwgen makes from spec, one per seed.
+        '''
+
+        return cls.from_stages([wwgen.generate(spec, width, height, seed) for seed in seeds])
+
+    def _copy(self, b, stage):
+        '''
+        (Batch, int, Stage) -> None
+        Make board b a copy of stage.
+        '''
+
+        width, height = self._width, self._height
+        terrain = np.frombuffer(stage._terrain, np.uint8).reshape(height, width)
+        ox = self._ox
+        self.kind[b, PAD:PAD+height, ox:ox+width] = np.where(terrain != 0, WALL, EMPTY)
+
+        active = stage._active
+        player = stage._player if stage._player in active else None
+        if any(type(a) not in (ww.KeyboardPlayer, ww.Monster) for a in active) or \
+           (player is not None and active[0] is not player) or \
+           sum(type(a) is ww.KeyboardPlayer for a in active) != (player is not None):
+            raise ValueError('a Batch board steps its player first, then its Monsters')
+        last_monster = max((a._seq for a in active if type(a) is ww.Monster), default=-1)
+
+        k = 0
+        for a in stage.get_actors():
+            (x, y) = a.get_position()
+            if not (-1 <= y <= height and (-1 <= x <= width or type(a) is ww.Monster)):
+                raise ValueError('(%d, %d) is too far off the stage' % (x, y))
+            if not (3 - self._ox <= x < width + self._ox - 3):
+                self._grow(abs(x) + 3)
+            cell = (b, y + PAD, x + self._ox)
+            kind = {ww.KeyboardPlayer: PLAYER, ww.Monster: MONSTER, ww.Box: BOX,
+                    ww.sticky: STICKY, ww.Wall: WALL}.get(type(a))
+            if kind is None:
+                raise ValueError('a Batch can not hold a %s' % type(a).__name__)
+            if kind == STICKY:
+                if a._seq < last_monster:
+                    raise ValueError('a Batch board has its stickies after its Monsters')
+                self.stickies[cell] += 1
+            if self.kind[cell] == EMPTY:
+                self.kind[cell] = kind
+            elif not (kind == STICKY and self.kind[cell] in (MONSTER, STICKY)):
+                raise ValueError('a Batch board can only stack stickies on a Monster or on each other')
+            if kind == PLAYER:
+                self.player_x[b], self.player_y[b] = x, y
+                self.has_player[b] = True
+                self.dead[b] = a.is_dead()
+            elif kind == MONSTER:
+                self.monster_x[b, k], self.monster_y[b, k] = x, y
+                self.monster_dx[b, k], self.monster_dy[b, k] = a._dx, a._dy
+                self.monster_delay[b, k], self.monster_count[b, k] = a._delay, a._delay_count
+                self.alive[b, k] = True
+                self.inside_sticky[b, k] = a.inside_sticky
+                self.slot[cell] = k
+                k += 1
+
+    @property
+    def won(self):
+        '''All the Monsters of the board are dead.'''
+        return ~self.alive.any(axis=1)
+
+    @property
+    def done(self):
+        '''The game on the board is over.'''
+        return self.dead | self.won
+
+    def _in_bounds(self, x, y):
+        '''
+        (Batch, numpy.ndarray, numpy.ndarray) -> numpy.ndarray
+        Return whether each position (x, y) is on the stage.
+        '''
+
+        return (x >= 0) & (x < self._width) & (y >= 0) & (y < self._height)
+
+    def step(self, moves):
+        '''
+        (Batch, numpy.ndarray) -> None
+        Take one tick of every board that is not done, the player of
+        board b first making the move DIRECTIONS[moves[b]].
+        '''
+
+        playing = ~self.done
+        self.ticks[playing] += 1
+        self._make_room()
+        moves = np.asarray(moves, np.int64)
+        self._step_player(playing & self.has_player & (moves != 0), moves)
+        for k in range(self.alive.shape[1]):
+            self._step_monster(playing & self.alive[:, k], k)
+
+    def _make_room(self):
+        '''
+        (Batch) -> None
+        Make sure that every Monster on a board can take a step without
+        looking past the columns kept left and right of the stage.
+        '''
+
+        x = self.monster_x[self.alive]
+        ox = self._ox
+        if len(x) == 0 or (x.min() >= 3 - ox and x.max() < self._width + ox - 3):
+            return
+        self._grow(max(3 - ox - x.min(), x.max() - self._width - ox + 3, ox)) # at least double
+
+    def _grow(self, more):
+        '''
+        (Batch, int) -> None
+        Keep more columns on each side of the stage.
+        '''
+
+        pad = ((0, 0), (0, 0), (more, more))
+        self.kind = np.pad(self.kind, pad)
+        self.stickies = np.pad(self.stickies, pad)
+        self.slot = np.pad(self.slot, pad, constant_values=-1)
+        self._ox += more
+
+    def _step_player(self, moving, moves):
+        '''
+        (Batch, numpy.ndarray, numpy.ndarray) -> None
+        Move the players of the boards in moving, like KeyboardPlayer.move.
+        '''
+
+        b = np.flatnonzero(moving)
+        if len(b) == 0:
+            return
+        (dx, dy) = DIRECTIONS[moves[b]].T
+        x, y = self.player_x[b], self.player_y[b]
+        nx, ny = x + dx, y + dy
+        ox = self._ox
+        ahead = self.kind[b, ny + PAD, nx + ox]
+
+        # a Monster gets the player
+        caught = ahead == MONSTER
+        self._remove_player(b[caught])
+
+        # Boxes are pushed, and the player follows if that made room
+        pushing = (ahead == BOX) | (ahead == STICKY)
+        self._push(b[pushing], nx[pushing], ny[pushing], dx[pushing], dy[pushing])
+        ahead = self.kind[b, ny + PAD, nx + ox]
+        free = (ahead == EMPTY) & (pushing | self._in_bounds(nx, ny))
+        b, x, y, nx, ny = b[free], x[free], y[free], nx[free], ny[free]
+        self.kind[b, y + PAD, x + ox] = EMPTY
+        self.kind[b, ny + PAD, nx + ox] = PLAYER
+        self.player_x[b], self.player_y[b] = nx, ny
+
+    def _remove_player(self, b):
+        '''
+        (Batch, numpy.ndarray) -> None
+        Take the players of boards b off their boards: they were caught.
+        '''
+
+        self.kind[b, self.player_y[b] + PAD, self.player_x[b] + self._ox] = EMPTY
+        self.has_player[b] = False
+        self.dead[b] = True
+
+    def _take(self, b, gx, gy):
+        '''
+        (Batch, numpy.ndarray, numpy.ndarray, numpy.ndarray) -> numpy.ndarray
+        Take the Box or sticky that comes first in the grid cells (gx, gy)
+        of boards b away and return its kind.
+        '''
+
+        kind = self.kind[b, gy, gx]
+        left = self.stickies[b, gy, gx] - (kind == STICKY)
+        self.stickies[b, gy, gx] = left
+        self.kind[b, gy, gx] = np.where(left > 0, STICKY, EMPTY)
+        return kind
+
+    def _push(self, b, x, y, dx, dy):
+        '''
+        (Batch, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray) -> None
+        For each of the boards b, push the Box at (x, y) in direction
+        (dx, dy) along with the line in front of it, like Stage.push.
+        '''
+
+        ox = self._ox
+        # scan the lines: length is the number of Boxes in each
+        length = np.ones(len(b), np.int64)
+        scanning = np.ones(len(b), bool)
+        moves = np.zeros(len(b), bool)
+        while scanning.any():
+            s = np.flatnonzero(scanning)
+            lx, ly = x[s] + (length[s] - 1) * dx[s], y[s] + (length[s] - 1) * dy[s]
+            ax, ay = lx + dx[s], ly + dy[s]
+            last = self.kind[b[s], ly + PAD, lx + ox]
+            ahead = self.kind[b[s], ay + PAD, ax + ox]
+            ends = ((last == STICKY) & (ahead == MONSTER)) | \
+                   ((ahead == EMPTY) & self._in_bounds(ax, ay))
+            more = ~ends & ((ahead == BOX) | (ahead == STICKY))
+            moves[s[ends]] = True
+            length[s[more]] += 1
+            scanning[s[~more]] = False
+
+        b, x, y, dx, dy, length = b[moves], x[moves], y[moves], dx[moves], dy[moves], length[moves]
+        if len(b) == 0:
+            return
+
+        # the last Box moves onto the cell past the line, trapping a Monster there
+        ex, ey = x + length * dx + ox, y + length * dy + PAD
+        kind = self._take(b, x + (length - 1) * dx + ox, y + (length - 1) * dy + PAD)
+        trap = self.kind[b, ey, ex] == MONSTER
+        self.inside_sticky[b[trap], self.slot[b[trap], ey[trap], ex[trap]]] = True
+        self.kind[b[~trap], ey[~trap], ex[~trap]] = kind[~trap]
+        self.stickies[b, ey, ex] += kind == STICKY
+
+        # then the others from the far end, each one only if the cell in
+        # front of it was emptied
+        moving = length > 1
+        j = length - 2
+        while moving.any():
+            m = np.flatnonzero(moving)
+            fx, fy = x[m] + (j[m] + 1) * dx[m] + ox, y[m] + (j[m] + 1) * dy[m] + PAD
+            m = m[self.kind[b[m], fy, fx] == EMPTY]
+            fx, fy = x[m] + (j[m] + 1) * dx[m] + ox, y[m] + (j[m] + 1) * dy[m] + PAD
+            kind = self._take(b[m], x[m] + j[m] * dx[m] + ox, y[m] + j[m] * dy[m] + PAD)
+            self.kind[b[m], fy, fx] = kind
+            self.stickies[b[m], fy, fx] += kind == STICKY
+            moving[:] = False
+            moving[m] = j[m] > 0
+            j -= 1
+
+    def _step_monster(self, stepping, k):
+        '''
+        (Batch, numpy.ndarray, int) -> None
+        Step Monster slot k on the boards in stepping, like Monster.step.
+        '''
+
+        b = np.flatnonzero(stepping)
+        if len(b) == 0:
+            return
+        x, y = self.monster_x[b, k], self.monster_y[b, k]
+        ox = self._ox
+        gx, gy = x + ox, y + PAD
+
+        # a surrounded Monster dies, but still finishes its step
+        around = np.zeros(len(b), np.int64)
+        for (nx, ny) in NEIGHBOURS:
+            around += self.kind[b, gy + ny, gx + nx] != EMPTY
+        dies = around == 8
+        d = b[dies]
+        self.kind[d, gy[dies], gx[dies]] = np.where(self.stickies[d, gy[dies], gx[dies]] > 0, STICKY, EMPTY)
+        self.slot[d, gy[dies], gx[dies]] = -1
+        self.alive[d, k] = False
+
+        count = (self.monster_count[b, k] + 1) % self.monster_delay[b, k]
+        self.monster_count[b, k] = count
+        fires = (count == 0) & ~self.inside_sticky[b, k]
+        b, x, y, gx, gy, dies = b[fires], x[fires], y[fires], gx[fires], gy[fires], dies[fires]
+        dx, dy = self.monster_dx[b, k], self.monster_dy[b, k]
+        tx, ty = x + dx, y + dy
+        ahead = self.kind[b, ty + PAD, tx + ox]
+
+        self._remove_player(b[ahead == PLAYER])
+        blocked = ahead != EMPTY
+        bounce_x = blocked | (tx < 0) | (tx >= self._width)
+        bounce_y = blocked | (ty < 0) | (ty >= self._height)
+        self.monster_dx[b[bounce_x], k] = -dx[bounce_x]
+        self.monster_dy[b[bounce_y], k] = -dy[bounce_y]
+
+        moves = ~bounce_y
+        self.monster_x[b[moves], k], self.monster_y[b[moves], k] = tx[moves], ty[moves]
+        moves &= ~dies # a dead Monster is off the board already
+        b, gx, gy, tx, ty = b[moves], gx[moves], gy[moves], tx[moves] + ox, ty[moves] + PAD
+        self.kind[b, gy, gx] = EMPTY
+        self.slot[b, gy, gx] = -1
+        self.kind[b, ty, tx] = MONSTER
+        self.slot[b, ty, tx] = k
+
+def simulate(spec, width, height, seeds, ticks, move_seed=0):
+    '''
+    (dict, int, int, list of int, int, int) -> dict
+    Play the boards wwgen makes from spec, one per seed, for at most ticks
+    ticks, with random moves drawn from move_seed, and return how each game
+    ended, and how long the stepping took. Every argument can be pickled, so this can be run in a
+    multiprocessing.Pool.
+    '''
+
+    batch = Batch.generate(spec, width, height, seeds)
+    moves = np.random.default_rng(move_seed)
+    start = time.perf_counter()
+    for i in range(ticks):
+        if batch.done.all():
+            break
+        batch.step(moves.integers(0, len(DIRECTIONS), len(seeds)))
+    return {'seeds': list(seeds),
+            'step_seconds': time.perf_counter() - start,
+            'ticks': batch.ticks.tolist(),
+            'dead': batch.dead.tolist(),
+            'won': batch.won.tolist()}
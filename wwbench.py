@@ -0,0 +1,816 @@
+'''
+Benchmarks for the ww game engine. Each benchmark prints its results as JSON.
+
+    python wwbench.py icons [--actors N]
+    python wwbench.py tick [--size N ...] [--monsters N ...] [--chasers N ...] [--seeds N ...] [--engine vector|sharded]
+    python wwbench.py check-vector [--size N ...] [--monsters N ...] [--seeds N ...] [--engine sharded]
+    python wwbench.py check-batch [--size N ...] [--monsters N ...] [--seeds N ...]
+    python wwbench.py check-render [--size N ...] [--monsters N ...] [--seeds N ...] [--window N]
+    python wwbench.py check-world [--size N ...] [--monsters N ...] [--seeds N ...] [--chunk-size N]
+    python wwbench.py check-flow [--size N ...] [--chasers N ...] [--seeds N ...] [--pushes N]
+    python wwbench.py check-solve
+    python wwbench.py profile [--size N ...] [--monsters N ...] [--seeds N ...]
+    python wwbench.py chase [--size N ...] [--chasers N ...] [--seeds N ...] [--move-rate P]
+    python wwbench.py solve [--seeds N ...] [--strategy bfs|best] [--time-limit SECONDS]
+    python wwbench.py batch [--boards N] [--ticks N] [--processes N]
+    python wwbench.py startup [--size N ...]
+'''
+
+import argparse, itertools, json, os, platform, random, resource, subprocess, sys, time
+
+# benchmarks never need a real window, and the banner pygame prints when the
+# ones that draw import it would corrupt the JSON
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import ww, wwgen
+
+ICON_DIR = os.path.dirname(os.path.abspath(__file__))
+WALL_ICON = os.path.join(ICON_DIR, 'wall.jpg')
+BOX_ICON = os.path.join(ICON_DIR, 'emblem-package-2-24.png')
+STICKY_ICON = os.path.join(ICON_DIR, 'edit-delete-8.png')
+PLAYER_ICON = os.path.join(ICON_DIR, 'face-cool-24.png')
+MONSTER_ICON = os.path.join(ICON_DIR, 'face-devil-grin-24.png')
+ICONS = {'player': PLAYER_ICON, 'monster': MONSTER_ICON, 'chaser': MONSTER_ICON, 'sticky': STICKY_ICON,
+         'box': BOX_ICON, 'wall': WALL_ICON}
+
+# the wwgame.py board as densities, so that it can be made at any size
+STARTUP_BOARD = {'monsters': 0.0075, 'stickies': 0.01, 'boxes': 0.25, 'walls': 0.015}
+
+KEYS = tuple(ww.KEY_MOVES)
+MOVES = tuple(ww.KEY_MOVES.values())
+
+# the arguments of the commands that play boards, and their usual defaults
+BOARD_ARGUMENTS = {'size': [20], 'monsters': [3], 'chasers': [0], 'boxes': [100], 'walls': [100],
+                   'stickies': [4], 'seeds': [0], 'ticks': 300, 'input_rate': 0.5}
+
+def environment():
+    '''
+    () -> dict
+    Return a description of what is being benchmarked, so that results
+    from different versions can be told apart.
+    '''
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ICON_DIR,
+                                  check=True, capture_output=True,
+                                  text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    import pygame
+    return {'revision': revision,
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def max_rss_kb():
+    '''
+    () -> int
+    Return the peak resident set size of this process in kilobytes.
+    '''
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024 # reported in bytes on macOS
+    return rss
+
+def build_icon_stage(num_actors, cached):
+    '''
+    (int, bool) -> dict
+    Build a square Stage holding num_actors Walls and Boxes and return the
+    construction time and memory growth. When cached is False every actor
+    also decodes and keeps its own copy of its image, as Actors did before
+    the registry existed.
+    '''
+
+    import pygame
+    pygame.init()
+    side = int(num_actors ** 0.5) + 1
+    stage = ww.Stage(side, side, 24)
+    own_icons = []
+    rss_before = max_rss_kb()
+    start = time.perf_counter()
+    for i in range(num_actors):
+        if not cached:
+            own_icons.append(pygame.image.load(BOX_ICON if i % 7 == 0 else WALL_ICON))
+        x, y = i % side, i // side
+        if i % 7 == 0:
+            stage.add_actor(ww.Box(BOX_ICON, stage, x, y))
+        else:
+            stage.add_actor(ww.Wall(WALL_ICON, stage, x, y))
+    elapsed = time.perf_counter() - start
+    return {'mode': 'cached' if cached else 'uncached',
+            'actors': num_actors,
+            'build_seconds': elapsed,
+            'actors_per_second': num_actors / elapsed,
+            'rss_growth_kb': max_rss_kb() - rss_before}
+
+def build_board(width, height, monsters, boxes, walls, stickies, seed, icons=False, chasers=0,
+                window=None):
+    '''
+    (int, int, int, int, int, int, int, bool, int, tuple of two ints) -> (Stage, random.Random)
+    Build a headless wwgame.py style board with wwgen: a KeyboardPlayer,
+    then the Monsters, Chasers, stickies, Boxes and terrain Walls, each on
+    its own random cell. If window is given, the Stage is not headless
+    but has a window of window (columns, rows). Return the Stage and the
+    random generator, seeded with seed.
+    '''
+
+    rng = random.Random(seed)
+    stage = ww.Stage(width, height, 24, headless=window is None, icons=icons, window=window)
+    wwgen.build(stage, {'monsters': monsters, 'chasers': chasers, 'stickies': stickies,
+                        'boxes': boxes, 'walls': walls, 'icons': ICONS}, rng)
+    return stage, rng
+
+class Decoy(ww.Player):
+    '''
+    A player the Monsters can not get, for benchmarks of Chasers that do
+    not end when they catch it. A Monster that runs into it bounces off.
+    '''
+
+    __slots__ = ('_rng', '_move_rate')
+
+    def __init__(self, stage, x, y, rng, move_rate):
+        '''
+        (Decoy, Stage, int, int, random.Random, float) -> None
+        Construct a Decoy at (x, y) on stage that, each tick, makes a
+        random move with probability move_rate, drawn from rng.
+        '''
+
+        super().__init__(PLAYER_ICON, stage, x, y)
+        self._rng = rng
+        self._move_rate = move_rate
+
+    def step(self):
+        '''
+        (Decoy) -> None
+        Maybe make a random move, pushing Boxes like a KeyboardPlayer.
+        '''
+
+        if self._rng.random() >= self._move_rate:
+            return
+        (dx, dy) = self._rng.choice(MOVES)
+        (x, y) = (self._x + dx, self._y + dy)
+        actor = self._stage.get_actor(x, y)
+        if isinstance(actor, ww.Box):
+            self._stage.push(actor, dx, dy)
+            actor = self._stage.get_actor(x, y)
+        if actor is None and self._stage.is_in_bounds(x, y):
+            self.set_position(x, y)
+
+def build_decoy_board(board, move_rate):
+    '''
+    (dict, float) -> (Stage, random.Random)
+    Build the board described by board, with a Decoy that moves with
+    probability move_rate in place of the KeyboardPlayer.
+    '''
+
+    stage, rng = build_board(**board)
+    (x, y) = stage._player.get_position()
+    stage.remove_player()
+    stage.set_player(Decoy(stage, x, y, rng, move_rate))
+    return stage, rng
+
+def run_ticks(board, ticks, input_rate, engine='object', workers=2):
+    '''
+    (dict, int, float, str, int) -> dict
+    Build the board described by board, then run ticks steps of it, with
+    Stage.step if engine is 'object', with a wwvector.MonsterEngine if it
+    is 'vector' or with a wwshard.ShardedEngine using workers processes if
+    it is 'sharded'. Before each step the player gets a random key press with
+    probability input_rate. Return the timings and memory use.
+    '''
+
+    rss_before = max_rss_kb()
+    start = time.perf_counter()
+    stage, rng = build_board(**board)
+    build = time.perf_counter() - start
+    num_actors = len(stage.get_actors())
+    step = stage.step
+    if engine == 'vector':
+        import wwvector
+        step = wwvector.MonsterEngine(stage).step
+    elif engine == 'sharded':
+        import wwshard
+        sharded = wwshard.ShardedEngine(stage, workers)
+        step = sharded.step
+
+    stepping = 0.0
+    for i in range(ticks):
+        if rng.random() < input_rate:
+            stage.player_event(rng.choice(KEYS))
+        start = time.perf_counter()
+        step()
+        stepping += time.perf_counter() - start
+
+    result = dict(board)
+    result.update({'engine': engine,
+                   'actors': num_actors,
+                   'ticks': ticks,
+                   'build_seconds': build,
+                   'step_seconds': stepping,
+                   'ticks_per_second': ticks / stepping,
+                   'step_ns_per_actor': stepping / ticks / num_actors * 1e9,
+                   'actors_left': len(stage.get_actors()),
+                   'rss_growth_kb': max_rss_kb() - rss_before})
+    if stage._flow_field is not None:
+        result['flow_field_searches'] = stage._flow_field.searches
+        result['flow_field_repairs'] = stage._flow_field.repairs
+    if engine == 'sharded':
+        result['workers'] = sharded._workers
+        sharded.close()
+    return result
+
+def add_board_arguments(parser, **defaults):
+    '''
+    (argparse.ArgumentParser, ...) -> None
+    Add the arguments of the commands that play boards to parser: a list
+    of values for each board parameter, for boards to combine, then
+    --ticks and --input-rate. The keyword arguments override the
+    defaults in BOARD_ARGUMENTS; an argument whose default is None is
+    left out.
+    '''
+
+    defaults = dict(BOARD_ARGUMENTS, **defaults)
+    for name in ('size', 'monsters', 'chasers', 'boxes', 'walls', 'stickies', 'seeds'):
+        if defaults[name] is not None:
+            parser.add_argument('--' + name, type=int, nargs='+', default=defaults[name])
+    if defaults['ticks'] is not None:
+        parser.add_argument('--ticks', type=int, default=defaults['ticks'])
+    if defaults['input_rate'] is not None:
+        parser.add_argument('--input-rate', type=float, default=defaults['input_rate'])
+
+def boards(args):
+    '''
+    (argparse.Namespace) -> generator of dict
+    Yield the board parameters for every combination of the requested
+    sizes, actor counts and seeds.
+    '''
+
+    for size, monsters, chasers, boxes, walls, stickies, seed in itertools.product(
+            args.size, args.monsters, args.chasers, args.boxes, args.walls, args.stickies,
+            args.seeds):
+        yield {'width': size, 'height': size, 'monsters': monsters, 'chasers': chasers,
+               'boxes': boxes, 'walls': walls, 'stickies': stickies,
+               'seed': seed}
+
+def bench_tick(args):
+    '''
+    (argparse.Namespace) -> dict
+    Run Stage.step on every combination of the requested board parameters.
+    Each board runs in its own process so memory numbers stay separate.
+    '''
+
+    results = []
+    for board in boards(args):
+        out = subprocess.run([sys.executable, __file__, '_tick-board',
+                              json.dumps(board), '--ticks', str(args.ticks),
+                              '--input-rate', str(args.input_rate),
+                              '--engine', args.engine, '--workers', str(args.workers)],
+                             check=True, stdout=subprocess.PIPE, text=True).stdout
+        results.append(json.loads(out))
+    return {'benchmark': 'tick', 'environment': environment(), 'results': results}
+
+def check_vector(args):
+    '''
+    (argparse.Namespace) -> dict
+    Cross-check wwvector.MonsterEngine (or wwshard.ShardedEngine) against
+    Stage.step on every combination of the requested board parameters.
+    '''
+
+    import wwvector
+    engine = wwvector.MonsterEngine
+    if args.engine == 'sharded':
+        import wwshard
+        engine = lambda stage: wwshard.ShardedEngine(stage, args.workers, min_batch=0)
+    checked = []
+    for board in boards(args):
+        wwvector.cross_check(lambda: build_board(**board), args.ticks,
+                             args.input_rate, KEYS, engine)
+        checked.append(board)
+    return {'check': args.engine, 'ticks': args.ticks, 'boards': checked}
+
+def batch_board(batch, b, monsters):
+    '''
+    (wwbatch.Batch, int, int) -> tuple
+    Return everything a tick can change on board b of batch, which has
+    monsters Monster slots, in the form of stage_board.
+    '''
+
+    import wwbatch
+    player = (bool(batch.has_player[b]), int(batch.player_x[b]), int(batch.player_y[b]),
+              bool(batch.dead[b]))
+    slots = [(bool(batch.alive[b, k]), int(batch.monster_x[b, k]), int(batch.monster_y[b, k]),
+              int(batch.monster_dx[b, k]), int(batch.monster_dy[b, k]),
+              int(batch.monster_count[b, k]), bool(batch.inside_sticky[b, k]))
+             for k in range(monsters)]
+    ox, pad = batch._ox, wwbatch.PAD
+    kinds = batch.kind[b, pad:pad + batch._height, ox:ox + batch._width].tolist()
+    return player, slots, kinds
+
+def stage_board(stage, monsters):
+    '''
+    (Stage, list of Monster) -> tuple
+    Return everything a tick can change on stage, whose Monsters were
+    monsters when it was copied into a wwbatch.Batch: the player, the
+    Monster slots and the kind of the first thing in every cell.
+    '''
+
+    import wwbatch
+    kind = {type(None): wwbatch.EMPTY, ww.Wall: wwbatch.WALL, ww.Box: wwbatch.BOX,
+            ww.sticky: wwbatch.STICKY, ww.KeyboardPlayer: wwbatch.PLAYER,
+            ww.Monster: wwbatch.MONSTER}
+    p = stage._player
+    player = (p._seq is not None, p._x, p._y, p.is_dead())
+    slots = [(m._seq is not None, m._x, m._y, m._dx, m._dy, m._delay_count, m.inside_sticky)
+             for m in monsters]
+    kinds = [[kind[type(stage.get_actor(x, y))] for x in range(stage.get_width())]
+             for y in range(stage.get_height())]
+    return player, slots, kinds
+
+def check_batch(args):
+    '''
+    (argparse.Namespace) -> dict
+    Cross-check wwbatch.Batch against Stage.step. For every combination
+    of the requested board parameters, the boards of all the seeds go in
+    one Batch, and the Batch and the Stages get the same random moves,
+    one with probability input_rate on each tick.
+    Each board is compared with its Stage after every tick until it is
+    done. Raise AssertionError at the first difference.
+    '''
+
+    import numpy as np, wwbatch
+    keys = {d: key for key, d in wwbatch.KEY_DIRECTIONS.items()}
+    checked = []
+    for size, monsters, boxes, walls, stickies in itertools.product(
+            args.size, args.monsters, args.boxes, args.walls, args.stickies):
+        stages = [build_board(size, size, monsters, boxes, walls, stickies, seed)[0]
+                  for seed in args.seeds]
+        batch = wwbatch.Batch.from_stages(stages)
+        slots = [[a for a in stage.get_actors() if type(a) is ww.Monster] for stage in stages]
+        rng = np.random.default_rng(0)
+        for tick in range(args.ticks):
+            moves = np.where(rng.random(len(stages)) < args.input_rate,
+                             rng.integers(1, len(wwbatch.DIRECTIONS), len(stages)), 0)
+            playing = np.flatnonzero(~batch.done).tolist()
+            batch.step(moves)
+            for b in playing:
+                if moves[b]:
+                    stages[b].player_event(keys[moves[b]])
+                stages[b].step()
+                if batch_board(batch, b, len(slots[b])) != stage_board(stages[b], slots[b]):
+                    raise AssertionError('board of seed %d differs from Stage.step at tick %d'
+                                         % (args.seeds[b], tick))
+        checked.append({'width': size, 'height': size, 'monsters': monsters, 'boxes': boxes,
+                        'walls': walls, 'stickies': stickies, 'seeds': len(args.seeds),
+                        'board_ticks': int(batch.ticks.sum()), 'done': int(batch.done.sum())})
+    return {'check': 'batch', 'ticks': args.ticks, 'boards': checked}
+
+def check_render(args):
+    '''
+    (argparse.Namespace) -> dict
+    Cross-check the incremental redraws of wwrender.Renderer against full
+    ones. Every combination of the requested board parameters is played
+    with random key presses, in a window of args.window cells following
+    the player. After every tick, the window drawn by Stage.draw, which
+    only redraws the cells that changed, is compared with a full redraw
+    of the same viewport onto a Surface of its own. Raise AssertionError
+    at the first difference.
+    '''
+
+    import pygame, wwrender
+    checked = []
+    for board in boards(args):
+        stage, rng = build_board(**board, icons=True, window=(args.window, args.window))
+        for icon_file in ICONS.values():
+            ww.load_icon(icon_file) # no placeholders, they would make the first frames differ
+        stage.follow(stage._player)
+        stage.draw()
+        full = wwrender.Renderer(stage, stage._screen.copy(), stage._window)
+        for tick in range(args.ticks):
+            if rng.random() < args.input_rate:
+                stage.player_event(rng.choice(KEYS))
+            stage.step()
+            stage.draw()
+            full.set_viewport(*stage._renderer.get_viewport().topleft)
+            full.refresh()
+            full.draw()
+            if pygame.image.tobytes(stage._screen, 'RGB') != pygame.image.tobytes(full._screen, 'RGB'):
+                raise AssertionError('the window differs from a full redraw at tick %d of %s'
+                                     % (tick, board))
+        checked.append(board)
+    return {'check': 'render', 'ticks': args.ticks, 'window': args.window, 'boards': checked}
+
+def check_world(args):
+    '''
+    (argparse.Namespace) -> dict
+    Cross-check wwworld.World against Stage.step. Every combination of the
+    requested board parameters is split into a world of args.chunk_size
+    chunks, opened with radii that load all of it and step all of it every
+    tick, and played with random key presses next to a Stage loaded with
+    the same actors in the same order. Their actors are compared after
+    every tick (as multisets: a level file keeps the order of the actors
+    that step, not of the Boxes). Raise AssertionError at the first
+    difference.
+    '''
+
+    import collections, tempfile, wwlevel, wwvector, wwworld
+    state = lambda stage: collections.Counter(wwvector.monster_state(stage))
+    checked = []
+    for board in boards(args):
+        stage, rng = build_board(**board)
+        with tempfile.TemporaryDirectory() as directory:
+            chunks = wwworld.split(stage, directory, args.chunk_size)
+            radius = -(-max(board['width'], board['height']) // args.chunk_size)
+            world = wwworld.World(directory, radius + 1, radius, headless=True, icons=False)
+            path = os.path.join(directory, 'copy.wwl')
+            wwlevel.save(world.get_stage(), path)
+            copy = wwlevel.load(path, headless=True, icons=False)
+            for tick in range(args.ticks):
+                if rng.random() < args.input_rate:
+                    key = rng.choice(KEYS)
+                    world.player_event(key)
+                    copy.player_event(key)
+                world.step()
+                copy.step()
+                if state(world.get_stage()) != state(copy):
+                    raise AssertionError('World differs from Stage.step at tick %d of %s'
+                                         % (tick, board))
+            world.close()
+        checked.append(dict(board, chunks=chunks))
+    return {'check': 'world', 'ticks': args.ticks, 'chunk_size': args.chunk_size,
+            'boards': checked}
+
+def check_flow(args):
+    '''
+    (argparse.Namespace) -> dict
+    Cross-check the repairs of ww.FlowField against searches from
+    scratch. Every combination of the requested board parameters is
+    played with a Decoy for the player, while a few random Boxes are
+    pushed about every tick. After every tick, the distances of the
+    Stage's field, which are repaired when only cells changed, are
+    compared with those of a new field. Raise AssertionError at the
+    first difference.
+    '''
+
+    checked = []
+    for board in boards(args):
+        stage, rng = build_decoy_board(board, args.move_rate)
+        field = stage.get_flow_field()
+        for tick in range(args.ticks):
+            boxes = [actor for actor in stage.get_actors() if type(actor) is ww.Box]
+            for box in rng.sample(boxes, min(args.pushes, len(boxes))):
+                stage.push(box, *rng.choice(MOVES))
+            stage.step()
+            field._update()
+            fresh = ww.FlowField(stage, field._reach)
+            fresh._update()
+            if field._distances != fresh._distances:
+                raise AssertionError('the repaired distances differ from a search at tick %d of %s'
+                                     % (tick, board))
+        checked.append(dict(board, searches=field.searches, repairs=field.repairs))
+    return {'check': 'flow', 'ticks': args.ticks, 'boards': checked}
+
+def check_solve(args):
+    '''
+    (argparse.Namespace) -> dict
+    Check which moves wwsolve prunes for pushing a Box onto a dead cell,
+    on a 7x7 stage with a Wall at (1, 1), which makes (0, 0) dead. Each
+    case puts the player and the Boxes on it, presses a key for one tick
+    and compares whether the Solver prunes the move with what it should.
+    Raise AssertionError at the first difference.
+    '''
+
+    import wwsolve
+    cases = [
+        # (player, Boxes, key, pruned)
+        ((3, 0), [(0, 0), (2, 0)], ord('a'), False), # a Box already on the dead cell is left alone
+        ((2, 0), [(0, 0)], ord('a'), False), # walking up to a Box on the dead cell
+        ((2, 0), [(1, 0)], ord('a'), True), # pushing a Box onto the dead cell
+        ((3, 0), [(1, 0), (2, 0)], ord('a'), True), # pushing two Boxes, the far one onto it
+        ((2, 1), [(1, 0)], ord('w'), False), # walking past the Box
+    ]
+    for player, boxes, key, pruned in cases:
+        stage = ww.Stage(7, 7, 24, headless=True, icons=False)
+        wwgen.build(stage, {'player': player, 'icons': ICONS,
+                            'fixed': [('wall', 1, 1)] + [('box', x, y) for (x, y) in boxes]})
+        solver = wwsolve.Solver(stage)
+        history = solver._history
+        history.mark()
+        solver._stage.player_event(key)
+        solver._stage.step()
+        if solver._pushed_dead_box(history.changes()) != pruned:
+            raise AssertionError('the move %s from %s with Boxes at %s is%s pruned'
+                                 % (chr(key), player, boxes, ' not' if pruned else ''))
+    return {'check': 'solve', 'cases': len(cases)}
+
+def profile(args):
+    '''
+    (argparse.Namespace) -> dict
+    Run every combination of the requested board parameters under a
+    wwprofile.Profiler, and return where the time of the ticks went.
+    '''
+
+    import wwprofile
+    results = []
+    for board in boards(args):
+        stage, rng = build_board(**board)
+        profiler = wwprofile.Profiler(stage)
+        profiler.start()
+        for i in range(args.ticks):
+            if rng.random() < args.input_rate:
+                stage.player_event(rng.choice(KEYS))
+            stage.step()
+        profiler.stop()
+        result = dict(board)
+        result.update(profiler.report())
+        results.append(result)
+    return {'benchmark': 'profile', 'environment': environment(), 'results': results}
+
+def bench_chase(args):
+    '''
+    (argparse.Namespace) -> dict
+    Run Stage.step on every combination of the requested board
+    parameters with a Decoy for the player, so that the Chasers chase it
+    for all the ticks instead of ending the game, and return how long the
+    searches and repairs of the FlowField took.
+    '''
+
+    results = []
+    for board in boards(args):
+        stage, rng = build_decoy_board(board, args.move_rate)
+        field = stage.get_flow_field()
+        spent = {'_search': 0.0, '_repair': 0.0}
+        def timed(name, method):
+            def run(*args):
+                start = time.perf_counter()
+                method(*args)
+                spent[name] += time.perf_counter() - start
+            return run
+        for name in spent:
+            setattr(field, name, timed(name, getattr(field, name)))
+        start = time.perf_counter()
+        for i in range(args.ticks):
+            stage.step()
+        stepping = time.perf_counter() - start
+        result = dict(board)
+        result.update({'ticks': args.ticks,
+                       'ticks_per_second': args.ticks / stepping,
+                       'chasers_left': sum(type(a) is ww.Chaser for a in stage.get_actors()),
+                       'field_cells': len(field._distances),
+                       'searches': field.searches,
+                       'search_ms': spent['_search'] / max(field.searches, 1) * 1e3,
+                       'repairs': field.repairs,
+                       'repair_ms': spent['_repair'] / max(field.repairs, 1) * 1e3,
+                       'field_share': (spent['_search'] + spent['_repair']) / stepping})
+        results.append(result)
+    return {'benchmark': 'chase', 'environment': environment(), 'results': results}
+
+def bench_solve(args):
+    '''
+    (argparse.Namespace) -> dict
+    Search the wwgame.py board of every seed with wwsolve, for at most
+    args.time_limit seconds each, and return what was found and how fast.
+    Each win found is played on a fresh board to check that it wins.
+    '''
+
+    import statistics, wwgame, wwsolve
+    results = []
+    for seed in args.seeds:
+        stage = ww.Stage(20, 20, 24, headless=True, icons=False)
+        wwgame.build(stage, random.Random(seed))
+        result = wwsolve.solve(stage, args.strategy, args.max_ticks, args.max_nodes,
+                               args.time_limit, args.weight)
+        if result['solved']:
+            wwsolve.play(stage, result['path'])
+            if any(isinstance(a, ww.Monster) for a in stage.get_actors()) or stage._player._seq is None:
+                raise AssertionError('the win found for seed %d does not win' % seed)
+        del result['path']
+        results.append(dict(result, seed=seed))
+    seconds = [r['seconds'] for r in results if r['solved']]
+    return {'benchmark': 'solve', 'environment': environment(),
+            'solved': len(seconds), 'boards': len(results),
+            'median_seconds_solved': statistics.median(seconds) if seconds else None,
+            'results': results}
+
+def bench_batch(args):
+    '''
+    (argparse.Namespace) -> dict
+    Play args.boards random wwgame.py games with wwbatch, split among
+    args.processes processes, and return the board ticks per second.
+    '''
+
+    import multiprocessing, wwbatch, wwgame
+    seeds = list(range(args.boards))
+    chunks = [seeds[i::args.processes] for i in range(args.processes)]
+    jobs = [(wwgame.BOARD, 20, 20, chunk, args.ticks, i) for i, chunk in enumerate(chunks)]
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(wwbatch.simulate, jobs)
+    elapsed = time.perf_counter() - start
+    board_ticks = sum(sum(r['ticks']) for r in results)
+    step_seconds = max(r['step_seconds'] for r in results)
+    return {'benchmark': 'batch',
+            'environment': environment(),
+            'boards': args.boards,
+            'processes': args.processes,
+            'board_ticks': board_ticks,
+            'seconds': elapsed,
+            'step_seconds': step_seconds,
+            'board_ticks_per_second': board_ticks / step_seconds,
+            'dead': sum(sum(r['dead']) for r in results),
+            'won': sum(sum(r['won']) for r in results)}
+
+def import_seconds(module):
+    '''
+    (str) -> float
+    Return how long importing module takes in a fresh interpreter,
+    including the modules it imports.
+    '''
+
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         cwd=ICON_DIR, check=True, stderr=subprocess.PIPE, text=True).stderr
+    for line in err.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ValueError('no import time for %s' % module)
+
+def startup_board(size, seed):
+    '''
+    (int, int) -> dict
+    Open a window on a size by size wwgame.py style board, with images,
+    and return how long it took to build the board, to draw the first
+    frame, and to draw a frame with all the images decoded. Meant to run
+    in a fresh process, where no image has been decoded yet.
+    '''
+
+    import pygame
+    start = time.perf_counter()
+    pygame.init()
+    stage = ww.Stage(size, size, 24, window=(min(size, 40), min(size, 40)))
+    wwgen.build(stage, dict(STARTUP_BOARD, icons=ICONS), random.Random(seed))
+    built = time.perf_counter()
+    stage.draw()
+    first_frame = time.perf_counter()
+    while not all(ww.icon_ready(f) for f in ICONS.values()):
+        time.sleep(0.0005)
+    stage.draw()
+    ready = time.perf_counter()
+    return {'size': size,
+            'actors': len(stage.get_actors()),
+            'build_seconds': built - start,
+            'first_frame_seconds': first_frame - start,
+            'images_ready_seconds': ready - start}
+
+def bench_startup(args):
+    '''
+    (argparse.Namespace) -> dict
+    Time importing ww and wwgame, and the startup of a board of every
+    requested size, each in its own process.
+    '''
+
+    results = []
+    for size in args.size:
+        out = subprocess.run([sys.executable, __file__, '_startup-board', str(size),
+                              '--seed', str(args.seed)],
+                             check=True, stdout=subprocess.PIPE, text=True).stdout
+        results.append(json.loads(out))
+    return {'benchmark': 'startup',
+            'environment': environment(),
+            'import_ww_seconds': import_seconds('ww'),
+            'import_wwgame_seconds': import_seconds('wwgame'),
+            'results': results}
+
+def bench_icons(args):
+    '''
+    (argparse.Namespace) -> dict
+    Compare cached and uncached Actor construction. Each mode runs in its
+    own process so that the memory numbers do not contaminate each other.
+    '''
+
+    results = []
+    for mode in ('uncached', 'cached'):
+        out = subprocess.run([sys.executable, __file__, '_icon-stage', mode,
+                              '--actors', str(args.actors)],
+                             check=True, stdout=subprocess.PIPE, text=True).stdout
+        results.append(json.loads(out))
+    uncached, cached = results
+    return {'benchmark': 'icons',
+            'environment': environment(),
+            'results': results,
+            'speedup': uncached['build_seconds'] / cached['build_seconds']}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    icons = commands.add_parser('icons', help='cached vs uncached icon loading')
+    icons.add_argument('--actors', type=int, default=10000)
+    icons.set_defaults(run=bench_icons)
+
+    # used by bench_icons to measure one mode in a fresh process
+    icon_stage = commands.add_parser('_icon-stage')
+    icon_stage.add_argument('mode', choices=('cached', 'uncached'))
+    icon_stage.add_argument('--actors', type=int, default=10000)
+    icon_stage.set_defaults(
+        run=lambda args: build_icon_stage(args.actors, args.mode == 'cached'))
+
+    tick = commands.add_parser('tick', help='Stage.step throughput on headless boards')
+    add_board_arguments(tick, size=[20, 100], monsters=[3, 100], ticks=1000)
+    tick.add_argument('--engine', choices=('object', 'vector', 'sharded'), default='object')
+    tick.add_argument('--workers', type=int, default=2, help='processes for the sharded engine')
+    tick.set_defaults(run=bench_tick)
+
+    check = commands.add_parser('check-vector', help='compare wwvector with Stage.step')
+    add_board_arguments(check, size=[10, 20, 60], monsters=[3, 40], boxes=[20], walls=[10],
+                        seeds=[0, 1, 2])
+    check.add_argument('--engine', choices=('vector', 'sharded'), default='vector')
+    check.add_argument('--workers', type=int, default=2)
+    check.set_defaults(run=check_vector)
+
+    check_b = commands.add_parser('check-batch', help='compare wwbatch with Stage.step')
+    add_board_arguments(check_b, size=[10, 20, 40], monsters=[3, 30], chasers=None, boxes=[20],
+                        walls=[10], seeds=list(range(50)), input_rate=0.2)
+    check_b.set_defaults(run=check_batch)
+
+    check_r = commands.add_parser('check-render', help='compare incremental redraws with full ones')
+    add_board_arguments(check_r, size=[20, 40], monsters=[3, 30], boxes=[60], walls=[20],
+                        seeds=[0, 1, 2])
+    check_r.add_argument('--window', type=int, default=15, help='columns and rows of cells shown')
+    check_r.set_defaults(run=check_render)
+
+    check_w = commands.add_parser('check-world', help='compare wwworld.World with Stage.step')
+    add_board_arguments(check_w, size=[20, 60], monsters=[3, 30], boxes=[60], walls=[20],
+                        seeds=[0, 1, 2])
+    check_w.add_argument('--chunk-size', type=int, default=8)
+    check_w.set_defaults(run=check_world)
+
+    check_f = commands.add_parser('check-flow', help='compare FlowField repairs with searches')
+    add_board_arguments(check_f, size=[30, 60], chasers=[30], boxes=[100, 400], walls=[20],
+                        seeds=[0, 1, 2], input_rate=None)
+    check_f.add_argument('--move-rate', type=float, default=0.2, help='chance the player moves in a tick')
+    check_f.add_argument('--pushes', type=int, default=3, help='random Boxes pushed every tick')
+    check_f.set_defaults(run=check_flow)
+
+    check_s = commands.add_parser('check-solve', help='check the moves wwsolve prunes')
+    check_s.set_defaults(run=check_solve)
+
+    prof = commands.add_parser('profile', help='where the time of a tick goes, per Actor class')
+    add_board_arguments(prof, size=[100], monsters=[100], boxes=[1000], walls=[1000], stickies=[20],
+                        ticks=1000)
+    prof.set_defaults(run=profile)
+
+    chase = commands.add_parser('chase', help='FlowField cost with Chasers after a player they can not get')
+    add_board_arguments(chase, size=[100, 300], monsters=[0], chasers=[100, 3000], input_rate=None)
+    chase.add_argument('--move-rate', type=float, default=0.5, help='chance the player moves in a tick')
+    chase.set_defaults(run=bench_chase)
+
+    solve = commands.add_parser('solve', help='wwsolve on wwgame.py boards')
+    solve.add_argument('--seeds', type=int, nargs='+', default=list(range(20)))
+    solve.add_argument('--strategy', choices=('bfs', 'best'), default='best')
+    solve.add_argument('--weight', type=int, default=2)
+    solve.add_argument('--max-ticks', type=int, default=300)
+    solve.add_argument('--max-nodes', type=int, default=10000000)
+    solve.add_argument('--time-limit', type=float, default=10)
+    solve.set_defaults(run=bench_solve)
+
+    batch = commands.add_parser('batch', help='wwbatch throughput on many small games')
+    batch.add_argument('--boards', type=int, default=10000)
+    batch.add_argument('--ticks', type=int, default=1000)
+    batch.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    batch.set_defaults(run=bench_batch)
+
+    startup = commands.add_parser('startup', help='import time, board build time and time to first frame')
+    startup.add_argument('--size', type=int, nargs='+', default=[20, 200, 1000])
+    startup.add_argument('--seed', type=int, default=0)
+    startup.set_defaults(run=bench_startup)
+
+    # used by bench_startup to measure one board in a fresh process
+    startup_one = commands.add_parser('_startup-board')
+    startup_one.add_argument('size', type=int)
+    startup_one.add_argument('--seed', type=int, default=0)
+    startup_one.set_defaults(run=lambda args: startup_board(args.size, args.seed))
+
+    # used by bench_tick to measure one board in a fresh process
+    tick_board = commands.add_parser('_tick-board')
+    tick_board.add_argument('board', type=json.loads)
+    tick_board.add_argument('--ticks', type=int, default=1000)
+    tick_board.add_argument('--input-rate', type=float, default=0.5)
+    tick_board.add_argument('--engine', choices=('object', 'vector', 'sharded'), default='object')
+    tick_board.add_argument('--workers', type=int, default=2)
+    tick_board.set_defaults(
+        run=lambda args: run_ticks(args.board, args.ticks, args.input_rate,
+                                   args.engine, args.workers))
+
+    args = parser.parse_args(argv)
+    results = json.dumps(args.run(args), indent=2)
+    print(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,100 @@
-import sys, pygame, random
+import sys, random, argparse
+import wwgen
 from ww import *
-pygame.init()
-
-ww=Stage(20, 20, 24)
-ww.set_player(KeyboardPlayer("icons/face-cool-24.png", ww))
-ww.add_actor(Monster("icons/face-devil-grin-24.png", ww, 7, 4, 5))
-ww.add_actor(Monster("icons/face-devil-grin-24.png", ww, 4, 10, 3))
-ww.add_actor(Monster("icons/face-devil-grin-24.png", ww, 5, 20, 2))
-ww.add_actor(sticky("icons/edit-delete-8.png",ww,1,1))
-ww.add_actor(sticky("icons/edit-delete-8.png",ww,10,10,))
-ww.add_actor(sticky("icons/edit-delete-8.png",ww,8,15,))
-ww.add_actor(sticky("icons/edit-delete-8.png",ww,9,1,))
-
-# The Loop is constructing a random width and height as x and y coordinates
-# following that the loop then sets the boxes at these random x and y
-# coordinates and adds 1 to counter and then continues to unitl there are 99
-# boxes.
-
-num_boxes=0
-while num_boxes<100:
-    x=random.randrange(ww.get_width())
-    y=random.randrange(ww.get_height())
-    if ww.get_actor(x,y) is None:
-        ww.add_actor(Box("icons/emblem-package-2-24.png", ww, x, y))
-        ww.add_actor(Wall("icons/wall.jpg", ww, 3, 4))
-        ww.add_actor(Wall("icons/wall.jpg", ww, 3, 5))
-        ww.add_actor(Wall("icons/wall.jpg", ww, 3, 6))
-        ww.add_actor(Wall("icons/wall.jpg", ww, 9, 9))
-        ww.add_actor(Wall("icons/wall.jpg", ww, 9, 8))
-        ww.add_actor(Wall("icons/wall.jpg", ww, 12, 12))
-        num_boxes+=1
-
-# The Loop is checking the what buttons the user is clicking. If the player
-# clicks the quit then this loop goes through to the quit part and exits
-# closing the window. Else if the user presses a key button then the player
-# moves in that direction. As well it refreshes the pygame everytime a move is
-# made by the Actors.
-
-while True:
-    pygame.time.wait(100)
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit(0)
-        if event.type == pygame.KEYDOWN:
-            ww.player_event(event.key)
-    ww.step()
-    ww.draw()
-
-
-
-
-
-
-
-            
+
+# the board of the game: the player, the Monsters, the stickies and the
+# Walls are always in the same place, the 100 Boxes are put on random cells
+BOARD = {'player': (0, 0),
+         'fixed': [('monster', 7, 4, 5), ('monster', 4, 10, 3), ('monster', 5, 20, 2),
+                   ('sticky', 1, 1), ('sticky', 10, 10), ('sticky', 8, 15), ('sticky', 9, 1),
+                   ('wall', 3, 4), ('wall', 3, 5), ('wall', 3, 6),
+                   ('wall', 9, 9), ('wall', 9, 8), ('wall', 12, 12)],
+         'boxes': 100}
+
+def build(ww, rng=random, chasers=0):
+    '''
+    (Stage, random.Random, int) -> None
+    Put the player, the Monsters, the stickies, the Walls and 100 Boxes of
+    the game on the empty Stage ww, and chasers Chasers. The Boxes and the
+    Chasers are placed using rng, so a generator seeded the same way
+    always gives the same board.
+    '''
+
+    wwgen.build(ww, dict(BOARD, chasers=chasers), rng)
+
+if __name__ == '__main__':
+    import pygame # only playing needs it, not the tools that build the board
+
+    parser = argparse.ArgumentParser(description='Play the game.')
+    parser.add_argument('--seed', type=int, help='seed for the board (random by default)')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the game to FILE, to be replayed with wwreplay.py')
+    parser.add_argument('--level', metavar='FILE',
+                        help='play the level saved in FILE by wwlevel.py instead of a random board')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='show where the time goes while playing, and write it to FILE as JSON')
+    parser.add_argument('--world', metavar='DIR',
+                        help='play the world written to DIR by wwworld.py, loading it chunk by chunk')
+    parser.add_argument('--window', type=int, nargs=2, metavar=('COLUMNS', 'ROWS'),
+                        help='cells shown in the window, which follows the player over a bigger stage')
+    parser.add_argument('--chasers', type=int, default=0,
+                        help='also put this many Monsters that chase the player on the board')
+    args = parser.parse_args()
+    if (args.level or args.world) and args.record:
+        parser.error('only games on a random board can be recorded')
+    if args.level and args.world:
+        parser.error('play either a level or a world')
+    if args.chasers and (args.level or args.world or args.record):
+        parser.error('only unrecorded games on a random board can have chasers')
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+
+    pygame.init()
+    world = None
+    if args.world:
+        import wwworld
+        world = wwworld.World(args.world, window=args.window or (30, 20))
+        ww = world.get_stage()
+    elif args.level:
+        import wwlevel
+        ww = wwlevel.load(args.level, window=args.window)
+    else:
+        ww=Stage(20, 20, 24, window=args.window)
+        build(ww, random.Random(seed), args.chasers)
+    if ww._player is not None:
+        ww.follow(ww._player)
+    # the images are decoded in the background while the window opens,
+    # cells whose image is not ready yet are drawn grey
+    ww.open_window()
+
+    # The GameLoop steps the Actors 10 times a second and redraws the stage
+    # in between. If the player clicks the quit button then the loop stops and
+    # the window is closed. Else if the user presses a key button then the player
+    # moves in that direction on the next step, and keeps moving every tick
+    # while the key is held down. On a board that is not recorded and not
+    # a world, the u key undoes the player's latest move, and the ones
+    # before it when pressed again.
+
+    if args.profile:
+        import wwprofile
+        profiler = wwprofile.Profiler(ww, overlay=True)
+        profiler.start()
+
+    if args.record:
+        import wwreplay
+        recorder = wwreplay.Recorder(ww, seed, args.record)
+        try:
+            GameLoop(recorder, tick_rate=10, key_repeat=(3, 1)).run()
+        finally:
+            recorder.close()
+    elif world is not None:
+        GameLoop(world, tick_rate=10, key_repeat=(3, 1)).run()
+        world.close()
+    else:
+        import wwsnap
+        game = wwsnap.Undoable(ww)
+        GameLoop(game, tick_rate=10, key_repeat=(3, 1)).run()
+        game.close()
+    if args.profile:
+        profiler.dump(args.profile)
+    pygame.quit()
+    sys.exit(0)
@@ -0,0 +1,161 @@
+'''
+Generate random boards.
+
+A board is described by a spec, a dict with:
+
+- 'player': where the player starts, (x, y); a random cell if missing
+- 'monsters', 'chasers', 'stickies', 'boxes', 'walls': how many of each
+  to put on random cells, either a number or, as a float, a density: the
+  fraction of the cells of the stage to fill with them
+- 'fixed': things put at given places before the random ones, as
+  (kind, x, y) with kind 'monster', 'chaser', 'sticky', 'box' or 'wall',
+  or ('monster', x, y, delay) or ('chaser', x, y, delay); fixed Monsters
+  and Chasers without a delay get Monster's default delay of 5
+- 'monster_delays': (low, high), random Monsters and Chasers get a delay
+  in range(low, high)
+- 'icons': the icon file of each kind, ICONS by default
+
+The random cells are drawn without replacement from the cells that
+nothing fixed is on, so no cell ever gets two things, and the whole board
+is then put on the Stage at once with Stage.populate.
+
+    stage = wwgen.generate({'boxes': 0.3, 'walls': 0.6, 'monsters': 1000}, 2000, 2000, seed=7)
+
+    python wwgen.py level.wwl --size 2000 --walls 0.6 --boxes 0.3 --seed 7
+'''
+
+import argparse, bisect, json, random, time
+
+import ww
+
+KINDS = ('player', 'monster', 'chaser', 'sticky', 'box', 'wall')
+ICONS = {'player': 'icons/face-cool-24.png',
+         'monster': 'icons/face-devil-grin-24.png',
+         'chaser': 'icons/face-devil-grin-24.png',
+         'sticky': 'icons/edit-delete-8.png',
+         'box': 'icons/emblem-package-2-24.png',
+         'wall': 'icons/wall.jpg'}
+# the key of a spec giving the number of each kind of thing
+COUNTS = {'monster': 'monsters', 'chaser': 'chasers', 'sticky': 'stickies', 'box': 'boxes', 'wall': 'walls'}
+
+def amount(value, cells):
+    '''
+    (int or float, int) -> int
+    Return how many things value asks for on a stage of cells cells:
+    value itself if it is an int, or that fraction of cells if it is a float.
+    '''
+
+    if isinstance(value, float):
+        return round(value * cells)
+    return value
+
+def build(stage, spec, rng=random):
+    '''
+    (Stage, dict, random.Random) -> None
+    Put the board described by spec on stage, which must be empty, using
+    rng for everything random. The same spec and an rng seeded the same
+    way always give the same board. The actors are added in this order:
+    the player, the Monsters, the Chasers, the stickies, the Boxes, fixed
+    ones before random ones. Walls go in the terrain layer.
+    '''
+
+    width, height = stage.get_width(), stage.get_height()
+    cells = width * height
+    icons = dict(ICONS, **spec.get('icons', {}))
+    fixed = {kind: [] for kind in KINDS}
+    taken = set()
+    fixed_places = list(spec.get('fixed', ()))
+    if 'player' in spec:
+        fixed_places.insert(0, ('player',) + tuple(spec['player']))
+    for place in fixed_places:
+        kind, x, y = place[:3]
+        if kind not in fixed:
+            raise ValueError('unknown kind of thing: %r' % (kind,))
+        if stage.is_in_bounds(x, y):
+            if y * width + x in taken:
+                raise ValueError('two things are fixed at (%d, %d)' % (x, y))
+            taken.add(y * width + x)
+        elif kind == 'wall':
+            raise ValueError('(%d, %d) is not on the stage' % (x, y))
+        fixed[kind].append(place)
+
+    wanted = {kind: amount(spec.get(key, 0), cells) for kind, key in COUNTS.items()}
+    wanted['player'] = 0 if 'player' in spec else 1
+    needed = sum(wanted.values())
+    if needed > cells - len(taken):
+        raise ValueError('%d things do not fit in the %d free cells of a %dx%d stage'
+                         % (needed, cells - len(taken), width, height))
+
+    # the k-th free cell is k plus the number of taken cells before it,
+    # and gaps[i] is the number of free cells before the i-th taken one
+    taken = sorted(taken)
+    gaps = [cell - i for i, cell in enumerate(taken)]
+    free = iter(rng.sample(range(cells - len(taken)), needed))
+
+    def places(kind): # the fixed places of kind, then the random ones
+        yield from fixed[kind]
+        for i in range(wanted[kind]):
+            k = next(free)
+            yield (kind,) + divmod(k + bisect.bisect_right(gaps, k), width)[::-1]
+
+    player = None
+    for place in places('player'):
+        player = ww.KeyboardPlayer(icons['player'], stage, place[1], place[2])
+    actors = [] if player is None else [player]
+    low, high = spec.get('monster_delays', (1, 6))
+    random_monsters = []
+    for kind, cls in (('monster', ww.Monster), ('chaser', ww.Chaser)):
+        for i, place in enumerate(places(kind)):
+            monster = cls(icons[kind], stage, *place[1:]) # fixed ones without a delay keep Monster's
+            if i >= len(fixed[kind]):
+                random_monsters.append(monster)
+            actors.append(monster)
+    actors.extend(ww.sticky(icons['sticky'], stage, x, y) for (kind, x, y) in places('sticky'))
+    actors.extend(ww.Box(icons['box'], stage, x, y) for (kind, x, y) in places('box'))
+
+    terrain = bytearray(cells)
+    for (kind, x, y) in places('wall'):
+        terrain[y * width + x] = 1
+    for monster in random_monsters:
+        monster._delay = rng.randrange(low, high)
+    stage.populate(terrain, [icons['wall']], actors, player)
+
+def generate(spec, width, height, seed=None, icon_dimension=24, headless=True, icons=False):
+    '''
+    (dict, int, int, int, int, bool, bool) -> Stage
+    Return a new width by height Stage with the board described by spec,
+    generated from seed. The other arguments are passed on to the Stage.
+    '''
+
+    stage = ww.Stage(width, height, icon_dimension, headless=headless, icons=icons)
+    build(stage, spec, random.Random(seed))
+    return stage
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a random board and save it as a level file.')
+    parser.add_argument('level')
+    parser.add_argument('--size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    for key in COUNTS.values():
+        parser.add_argument('--' + key, type=float, default=0.0,
+                            help='density of %s, or their number if at least 1' % key)
+    args = parser.parse_args(argv)
+
+    spec = {}
+    for key in COUNTS.values():
+        value = getattr(args, key)
+        spec[key] = value if value < 1 else int(value)
+    start = time.perf_counter()
+    stage = generate(spec, args.size, args.size, args.seed)
+    elapsed = time.perf_counter() - start
+
+    import wwlevel
+    wwlevel.save(stage, args.level)
+    print(json.dumps({'level': args.level,
+                      'spec': spec,
+                      'size': args.size,
+                      'actors': len(stage.get_actors()),
+                      'generate_seconds': elapsed}, indent=2))
+
+if __name__ == '__main__':
+    main()
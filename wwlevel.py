@@ -0,0 +1,266 @@
+'''
+Save Stages to level files, and load them back fast.
+
+A level file is a header, struct HEADER, followed by:
+
+- the palette: for each code 1, 2, ..., the kind of thing (TERRAIN, BOX,
+  ...) and the icon file it is drawn with, as struct ICON and the
+  UTF-8 bytes of the file name;
+- the grid: one byte per cell, row by row, the code of the terrain Wall
+  or of the lone Box in the cell, 0 for neither;
+- the entity table: everything else (the player, the Monsters, the
+  stickies, Boxes sharing their cell, ...), in stage order, as struct
+  ENTITY records.
+
+Loading handles the grid with bytes operations, but every Box in it
+still becomes a ww.Box added to the Stage, at a few microseconds each:
+a 2000x2000 level with 1.2 million Boxes takes about 4 seconds to load.
+Making the Boxes without running Actor.__init__ saves little, since
+most of that is creating the objects at all. Levels that big are better
+split with wwworld.split and played as a wwworld.World, which only loads
+the chunks around the player.
+
+    stage = wwlevel.load('level.wwl')
+    wwlevel.save(stage, 'snapshot.wwl')
+
+    python wwlevel.py level.wwl --from-seed 7 # write the wwgame.py board
+    python wwlevel.py level.wwl # time loading it
+'''
+
+import argparse, json, mmap, re, struct, time
+
+import ww
+
+MAGIC = b'WWLV'
+VERSION = 1
+HEADER = struct.Struct('<4sBIIIHI') # magic, version, width, height, icon dimension, palette size, entities
+ICON = struct.Struct('<BH') # kind, length of the icon file name
+ENTITY = struct.Struct('<BBiiHHbb') # code, flags, x, y, delay, delay count, dx, dy
+
+# the kinds of things in a level
+TERRAIN, BOX, STICKY, WALL, PLAYER, MONSTER, CHASER = range(1, 8)
+CLASSES = {BOX: ww.Box, STICKY: ww.sticky, WALL: ww.Wall,
+           PLAYER: ww.KeyboardPlayer, MONSTER: ww.Monster, CHASER: ww.Chaser}
+KINDS = {cls: kind for kind, cls in CLASSES.items()}
+
+# entity flags
+INSIDE_STICKY = 1 # a Monster stuck in a sticky
+IS_PLAYER = 2 # the player of the stage
+DEAD = 4 # a KeyboardPlayer that was caught
+
+class Palette:
+    '''
+    The codes of the kinds of things in a file: code c (from 1 on) stands
+    for the kind and the icon file in the entry c-1 of the list entries.
+    '''
+
+    def __init__(self, entries=()):
+        '''
+        (Palette, list of tuple of (int, str)) -> None
+        Construct a Palette holding entries.
+        '''
+
+        self.entries = list(entries)
+        self._codes = {key: c for c, key in enumerate(self.entries, 1)}
+
+    def code(self, kind, icon_file):
+        '''
+        (Palette, int, str) -> int
+        Return the code of kind drawn with icon_file, adding it if needed.
+        '''
+
+        key = (kind, icon_file)
+        c = self._codes.get(key)
+        if c is None:
+            if len(self.entries) == 255:
+                raise ValueError('a file can have at most 255 kinds of things')
+            self.entries.append(key)
+            c = self._codes[key] = len(self.entries)
+        return c
+
+    def write(self, f):
+        '''
+        (Palette, file) -> None
+        Write the entries to the binary file f, as struct ICON and the
+        UTF-8 bytes of the file name.
+        '''
+
+        for kind, icon_file in self.entries:
+            name = icon_file.encode('utf-8')
+            f.write(ICON.pack(kind, len(name)))
+            f.write(name)
+
+    @staticmethod
+    def read(data, offset, size):
+        '''
+        (bytes, int, int) -> (Palette, int)
+        Return the Palette of size entries written by write at offset in
+        data, and the offset just after it.
+        '''
+
+        entries = []
+        for i in range(size):
+            kind, length = ICON.unpack_from(data, offset)
+            offset += ICON.size
+            entries.append((kind, bytes(data[offset:offset + length]).decode('utf-8')))
+            offset += length
+        return Palette(entries), offset
+
+def pack_actors(stage, actors, palette):
+    '''
+    (Stage, list of Actor, Palette) -> bytes
+    Return the ENTITY records of actors, adding their kinds to palette.
+    Only the Actor classes in KINDS can be packed.
+    '''
+
+    entities = []
+    for a in actors:
+        kind = KINDS.get(type(a))
+        if kind is None:
+            raise ValueError('a %s can not be saved in a level' % type(a).__name__)
+        flags = 0
+        if getattr(a, 'inside_sticky', False):
+            flags |= INSIDE_STICKY
+        if a is stage._player:
+            flags |= IS_PLAYER
+        if kind == PLAYER and a.is_dead():
+            flags |= DEAD
+        (x, y) = a.get_position()
+        entities.append(ENTITY.pack(palette.code(kind, a._icon_file), flags, x, y,
+                                    a._delay, a._delay_count,
+                                    getattr(a, '_dx', 0), getattr(a, '_dy', 0)))
+    return b''.join(entities)
+
+def unpack_actors(stage, entities, palette):
+    '''
+    (Stage, bytes, Palette) -> (list of Actor, Player)
+    Return the Actors for stage in the ENTITY records entities, and the
+    one of them flagged as the player, or None.
+    '''
+
+    actors, player = [], None
+    for c, flags, x, y, delay, count, dx, dy in ENTITY.iter_unpack(entities):
+        kind, icon_file = palette.entries[c - 1]
+        cls = CLASSES.get(kind)
+        if cls is None:
+            raise ValueError('an entity of kind %d can not be loaded' % kind)
+        actor = cls(icon_file, stage, x, y, delay) if issubclass(cls, ww.Monster) else cls(icon_file, stage, x, y)
+        actor._delay, actor._delay_count = delay, count
+        if kind in (MONSTER, CHASER):
+            actor._dx, actor._dy = dx, dy
+            actor.inside_sticky = bool(flags & INSIDE_STICKY)
+        elif kind == PLAYER:
+            actor._dead = bool(flags & DEAD)
+        if flags & IS_PLAYER:
+            player = actor
+        actors.append(actor)
+    return actors, player
+
+def save(stage, path, actors=None):
+    '''
+    (Stage, str, list of Actor) -> None
+    Write everything on stage to the level file path, so that load gives
+    back a Stage that plays on exactly like it. Pending key presses are
+    not saved. Only the Actor classes in KINDS can be saved. If actors is
+    given, only those actors (in stage order) are saved, with all the terrain.
+    '''
+
+    width, height = stage.get_width(), stage.get_height()
+    palette = Palette()
+    kinds = bytearray(256) # terrain kinds of the stage -> codes
+    for kind, wall in enumerate(stage._walls[1:], 1):
+        kinds[kind] = palette.code(TERRAIN, wall._icon_file)
+    grid = bytearray(stage._terrain.translate(kinds))
+
+    # Boxes alone in their cell go in the grid. They are loaded after the
+    # entities, so only the Boxes after the last entity in the stage order
+    # can go there, and since then nothing can tell their order apart.
+    actors = list(stage.get_actors() if actors is None else actors)
+    while actors:
+        a = actors[-1]
+        (x, y) = a.get_position()
+        if type(a) is not ww.Box or not stage.is_in_bounds(x, y) or \
+           stage._cells[(x, y)] is not a or grid[y * width + x]:
+            break
+        grid[y * width + x] = palette.code(BOX, a._icon_file)
+        actors.pop()
+    entities = pack_actors(stage, actors, palette)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, height, stage._icon_dimension,
+                            len(palette.entries), len(entities) // ENTITY.size))
+        palette.write(f)
+        f.write(grid)
+        f.write(entities)
+
+def load(path, headless=False, icons=True, window=None):
+    '''
+    (str, bool, bool, tuple of two ints) -> Stage
+    Return a new Stage holding the level in the file path. headless,
+    icons and window are passed on to the Stage. The file is mapped into
+    memory and the whole grid is handled by bytes operations and
+    Stage.populate, so that only the Boxes and the entities cost Python work.
+    '''
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if len(data) < HEADER.size:
+            raise ValueError('%s is not a level file' % path)
+        magic, version, width, height, dimension, num_codes, num_entities = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a level file this version can load' % path)
+        palette, offset = Palette.read(data, HEADER.size, num_codes)
+        grid = data[offset:offset + width * height]
+        offset += width * height
+        entities = data[offset:offset + num_entities * ENTITY.size]
+        if len(grid) != width * height or len(entities) != num_entities * ENTITY.size:
+            raise ValueError('%s is cut short' % path)
+
+    stage = ww.Stage(width, height, dimension, headless=headless, icons=icons, window=window)
+    kinds, wall_icons = bytearray(256), [] # codes -> terrain kinds
+    boxes = bytearray() # codes of Boxes
+    for c, (kind, icon_file) in enumerate(palette.entries, 1):
+        if kind == TERRAIN:
+            wall_icons.append(icon_file)
+            kinds[c] = len(wall_icons)
+        elif kind in CLASSES:
+            if kind == BOX:
+                boxes.append(c)
+        else:
+            raise ValueError('%s holds things of unknown kind %d' % (path, kind))
+
+    actors, player = unpack_actors(stage, entities, palette)
+    if boxes:
+        cells = re.compile(b'[' + b''.join(re.escape(bytes([c])) for c in boxes) + b']')
+        for match in cells.finditer(grid):
+            (y, x) = divmod(match.start(), width)
+            actors.append(ww.Box(palette.entries[grid[match.start()] - 1][1], stage, x, y))
+
+    stage.populate(grid.translate(kinds), wall_icons, actors, player)
+    return stage
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a level file, or time loading one.')
+    parser.add_argument('level')
+    parser.add_argument('--from-seed', type=int, metavar='SEED',
+                        help='write the wwgame.py board built from SEED to the level file')
+    args = parser.parse_args(argv)
+
+    if args.from_seed is not None:
+        import random, wwgame
+        stage = ww.Stage(20, 20, 24, headless=True, icons=False)
+        wwgame.build(stage, random.Random(args.from_seed))
+        save(stage, args.level)
+
+    start = time.perf_counter()
+    stage = load(args.level, headless=True, icons=False)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'level': args.level,
+                      'width': stage.get_width(),
+                      'height': stage.get_height(),
+                      'actors': len(stage.get_actors()),
+                      'walls': len(stage._terrain) - stage._terrain.count(0),
+                      'load_seconds': elapsed}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+'''
+Find out where the time of a tick goes.
+
+A Profiler hooks into one Stage while it is started, by giving the Stage
+its own step, draw, get_actor, push and is_surrounded that measure and
+then do the real work. A Stage that is not being profiled runs the plain
+methods, so profiling costs nothing until it is started.
+
+    profiler = Profiler(stage, overlay=True)
+    profiler.start()
+    ... play ...
+    profiler.stop()
+    profiler.dump('profile.json')
+
+It records, for every tick, the time of Stage.step and Stage.draw; for
+every class of Actor, the time spent in its step; how often get_actor and
+is_surrounded are called; and how long the lines of Boxes pushed are.
+With overlay, the latest figures are drawn over the top left of the stage.
+'''
+
+import json, math, time
+
+import pygame
+
+from ww import Box
+
+class Histogram:
+    '''
+    Counts values in buckets that double in size: a value v goes in the
+    bucket of the smallest power of 2 that is more than v.
+    '''
+
+    def __init__(self):
+        '''
+        (Histogram) -> None
+        Construct an empty Histogram.
+        '''
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._buckets = {} # exponent -> number of values
+
+    def add(self, value):
+        '''
+        (Histogram, float) -> None
+        Count value.
+        '''
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        exponent = math.frexp(value)[1]
+        self._buckets[exponent] = self._buckets.get(exponent, 0) + 1
+
+    def to_dict(self):
+        '''
+        (Histogram) -> dict
+        Return the counts and the buckets, as JSON friendly values.
+        '''
+
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'buckets': {'< %g' % 2.0**e: n for e, n in sorted(self._buckets.items())}}
+
+class Profiler:
+    '''
+    Measures a Stage while it runs. See the module docstring.
+    '''
+
+    def __init__(self, stage, overlay=False):
+        '''
+        (Profiler, Stage, bool) -> None
+        Construct a Profiler for stage. If overlay is True, the figures are
+        drawn on the stage's screen after every draw.
+        '''
+
+        self._stage = stage
+        self._overlay = overlay
+        self._font = None
+        self._started = False
+        self.reset()
+
+    def reset(self):
+        '''
+        (Profiler) -> None
+        Forget everything measured so far.
+        '''
+
+        self.ticks = 0
+        self.step_time = Histogram() # seconds per Stage.step
+        self.draw_time = Histogram() # seconds per Stage.draw
+        self.class_time = {} # Actor class name -> seconds in its step
+        self.class_steps = {} # Actor class name -> number of steps
+        self.get_actor_calls = 0
+        self.is_surrounded_calls = 0
+        self.push_lengths = Histogram() # Boxes in each line pushed
+        self._last_tick_calls = 0 # get_actor calls in the latest tick
+
+    def start(self):
+        '''
+        (Profiler) -> None
+        Start measuring the stage.
+        '''
+
+        if self._started:
+            return
+        stage = self._stage
+        # the plain methods of the stage, which do the real work
+        plain_get_actor = stage.get_actor
+        plain_push = stage.push
+        plain_is_surrounded = stage.is_surrounded
+        plain_draw = stage.draw
+        clock = time.perf_counter
+
+        def step():
+            start = clock()
+            calls = self.get_actor_calls
+            keep = stage._step_filter
+            for a in list(stage._active):
+                if a._seq is not None and (keep is None or keep(a)):
+                    name = type(a).__name__
+                    before = clock()
+                    a.step()
+                    self.class_time[name] = self.class_time.get(name, 0.0) + clock() - before
+                    self.class_steps[name] = self.class_steps.get(name, 0) + 1
+            self.step_time.add(clock() - start)
+            self._last_tick_calls = self.get_actor_calls - calls
+            self.ticks += 1
+
+        def draw():
+            if self._overlay and stage._screen is not None:
+                stage._dirty.update(self._overlay_cells())
+            start = clock()
+            plain_draw()
+            self.draw_time.add(clock() - start)
+            if self._overlay and stage._screen is not None:
+                self._draw_overlay()
+
+        def get_actor(x, y):
+            self.get_actor_calls += 1
+            return plain_get_actor(x, y)
+
+        def push(box, dx, dy):
+            (x, y) = box.get_position()
+            length = 1
+            while isinstance(plain_get_actor(x + length*dx, y + length*dy), Box):
+                length += 1
+            self.push_lengths.add(length)
+            return plain_push(box, dx, dy)
+
+        def is_surrounded(x, y):
+            self.is_surrounded_calls += 1
+            return plain_is_surrounded(x, y)
+
+        # the Stage finds these before its own methods
+        stage.step, stage.draw, stage.get_actor = step, draw, get_actor
+        stage.push, stage.is_surrounded = push, is_surrounded
+        self._started = True
+
+    def stop(self):
+        '''
+        (Profiler) -> None
+        Stop measuring the stage, which then runs its plain methods again.
+        '''
+
+        if not self._started:
+            return
+        for name in ('step', 'draw', 'get_actor', 'push', 'is_surrounded'):
+            delattr(self._stage, name)
+        if self._overlay:
+            self._stage.refresh() # wipe the overlay
+        self._started = False
+
+    def report(self):
+        '''
+        (Profiler) -> dict
+        Return everything measured so far, as JSON friendly values.
+        '''
+
+        classes = {}
+        for name, seconds in sorted(self.class_time.items(), key=lambda item: -item[1]):
+            steps = self.class_steps[name]
+            classes[name] = {'steps': steps,
+                             'seconds': seconds,
+                             'ns_per_step': seconds / steps * 1e9,
+                             'share_of_step': seconds / self.step_time.total if self.step_time.total else None}
+        return {'ticks': self.ticks,
+                'actors': len(self._stage.get_actors()),
+                'step_seconds': self.step_time.to_dict(),
+                'draw_seconds': self.draw_time.to_dict(),
+                'classes': classes,
+                'get_actor_calls': self.get_actor_calls,
+                'get_actor_calls_per_tick': self.get_actor_calls / self.ticks if self.ticks else None,
+                'is_surrounded_calls': self.is_surrounded_calls,
+                'push_lengths': self.push_lengths.to_dict()}
+
+    def dump(self, path):
+        '''
+        (Profiler, str) -> None
+        Write report() to the file path as JSON.
+        '''
+
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def _overlay_lines(self):
+        '''
+        (Profiler) -> list of str
+        Return the lines of text shown by the overlay.
+        '''
+
+        def ms(histogram):
+            return histogram.total / histogram.count * 1000 if histogram.count else 0.0
+
+        lines = ['tick %d: step %.2f ms, draw %.2f ms' % (self.ticks, ms(self.step_time), ms(self.draw_time)),
+                 'get_actor %d/tick, pushes %d' % (self._last_tick_calls, self.push_lengths.count)]
+        for name, seconds in sorted(self.class_time.items(), key=lambda item: -item[1])[:3]:
+            lines.append('%s %.0f ns/step' % (name, seconds / self.class_steps[name] * 1e9))
+        return lines
+
+    OVERLAY_SIZE = (300, 80) # the pixel area the overlay may cover
+
+    def _overlay_cells(self):
+        '''
+        (Profiler) -> list of tuple of two ints
+        Return the cells under the overlay, which are redrawn before it.
+        '''
+
+        d = self._stage._icon_dimension
+        (width, height) = self.OVERLAY_SIZE
+        (left, top) = self._stage._renderer.get_viewport().topleft
+        return [(left + x, top + y) for y in range(-(-height // d)) for x in range(-(-width // d))]
+
+    def _draw_overlay(self):
+        '''
+        (Profiler) -> None
+        Draw the latest figures over the top left of the stage's screen.
+        '''
+
+        if self._font is None:
+            pygame.font.init()
+            self._font = pygame.font.SysFont(None, 18)
+        screen = self._stage._screen
+        area = pygame.Rect((0, 0), self.OVERLAY_SIZE).clip(screen.get_rect())
+        y = 2
+        for line in self._overlay_lines():
+            text = self._font.render(line, True, (255, 255, 0), (0, 0, 0))
+            screen.blit(text, (2, y), pygame.Rect((0, 0), (area.width - 2, area.height - y)))
+            y += text.get_height()
+        pygame.display.update(area)
@@ -0,0 +1,215 @@
+'''
+Draw a Stage layer by layer, with one Surface.blits call per layer.
+
+The cells to draw are sorted into layers: the empty background, the
+terrain (and Wall actors), the Boxes, the Monsters and the players. Every
+layer is drawn with a single Surface.blits call, from textures that are
+converted to the display's pixel format and scaled to the cell size once,
+onto destination Rects that are made once per cell of the viewport.
+
+The viewport is the part of the stage that is shown, a rectangle of
+cells whose top left corner can be moved to scroll a stage that is
+bigger than the window. Only the cells in the viewport are looked at,
+through the stage's index of occupied cells, so the cost of a frame
+depends on the size of the window and not on the size of the stage.
+
+The viewport can follow an actor like a camera: before every frame it is
+scrolled just enough to keep the actor a margin away from its edges.
+
+Images that are still being decoded in the background (see
+ww.preload_icon) are drawn as a grey placeholder, and the whole viewport
+is drawn again once they are all ready. A Stage without images has every
+actor drawn as the placeholder.
+'''
+
+import pygame
+
+from ww import Box, Monster, Player
+
+BACKGROUND, TERRAIN, BOXES, MONSTERS, PLAYERS = range(5)
+PLACEHOLDER_COLOUR = (96, 96, 96)
+
+class Renderer:
+    '''
+    Draws the cells of a Stage in its viewport onto a screen.
+    '''
+
+    def __init__(self, stage, screen, viewport_size=None):
+        '''
+        (Renderer, Stage, pygame.Surface, tuple of two ints) -> None
+        Construct a Renderer drawing stage onto screen. The viewport is
+        viewport_size cells, the whole stage by default, and starts at
+        the top left corner of the stage.
+        '''
+
+        self._stage = stage
+        self._screen = screen
+        self._d = d = stage._icon_dimension
+        (width, height) = viewport_size or (stage.get_width(), stage.get_height())
+        self._viewport = pygame.Rect(0, 0, min(width, stage.get_width()),
+                                     min(height, stage.get_height()))
+        # the Rect on the screen of each cell of the viewport, row by row
+        self._rects = [pygame.Rect(x*d, y*d, d, d)
+                       for y in range(self._viewport.height) for x in range(self._viewport.width)]
+        self._textures = {} # icon file -> the texture drawn for it
+        self._layers = {} # Actor class -> its layer
+        self._blank = pygame.Surface((d, d))
+        self._placeholder = pygame.Surface((d, d))
+        self._placeholder.fill(PLACEHOLDER_COLOUR)
+        self._loading = set() # icon files drawn as the placeholder, not decoded yet
+        self._redraw_all = True
+        self._target = None # the actor the viewport follows, if any
+        self._margin = 0
+
+    def get_viewport(self):
+        '''
+        (Renderer) -> pygame.Rect
+        Return the cells shown, as a Rect in cells.
+        '''
+
+        return self._viewport.copy()
+
+    def set_viewport(self, x, y):
+        '''
+        (Renderer, int, int) -> None
+        Scroll the viewport so that its top left cell is (x, y), or as
+        close to it as the stage allows.
+        '''
+
+        moved = self._viewport.copy()
+        moved.topleft = (x, y)
+        moved.clamp_ip(pygame.Rect(0, 0, self._stage.get_width(), self._stage.get_height()))
+        if moved.topleft != self._viewport.topleft:
+            self._viewport = moved
+            self._redraw_all = True
+
+    def follow(self, actor, margin=0):
+        '''
+        (Renderer, Actor, int) -> None
+        Scroll the viewport before every draw so that actor stays at least
+        margin cells away from its edges. None stops following.
+        '''
+
+        self._target = actor
+        self._margin = margin
+        self._track()
+
+    def _track(self):
+        '''
+        (Renderer) -> None
+        Scroll the viewport to the actor followed, if it is on the stage.
+        '''
+
+        actor = self._target
+        if actor is None or actor._seq is None:
+            return
+        (x, y) = actor.get_position()
+        view = self._viewport
+        # a margin of half the viewport or more keeps the actor in the middle
+        mx = min(self._margin, (view.width - 1) // 2)
+        my = min(self._margin, (view.height - 1) // 2)
+        (left, top) = view.topleft
+        if x < left + mx:
+            left = x - mx
+        elif x >= view.right - mx:
+            left = x - view.width + 1 + mx
+        if y < top + my:
+            top = y - my
+        elif y >= view.bottom - my:
+            top = y - view.height + 1 + my
+        self.set_viewport(left, top)
+
+    def refresh(self):
+        '''
+        (Renderer) -> None
+        Make the next draw redraw the whole viewport.
+        '''
+
+        self._redraw_all = True
+
+    def texture(self, icon_file):
+        '''
+        (Renderer, str) -> pygame.Surface
+        Return the image in icon_file converted and scaled to the cell
+        size. If the image is still being decoded, or if the stage does
+        not use images, return the placeholder.
+        '''
+
+        texture = self._textures.get(icon_file)
+        if texture is None:
+            if not self._stage.is_icon_ready(icon_file):
+                self._loading.add(icon_file)
+                return self._placeholder
+            texture = self._stage.load_icon(icon_file, (self._d, self._d)) or self._placeholder
+            self._textures[icon_file] = texture
+        return texture
+
+    def _layer(self, actor):
+        '''
+        (Renderer, Actor) -> int
+        Return the layer actor is drawn in.
+        '''
+
+        cls = type(actor)
+        layer = self._layers.get(cls)
+        if layer is None:
+            if issubclass(cls, Player):
+                layer = PLAYERS
+            elif issubclass(cls, Monster):
+                layer = MONSTERS
+            elif issubclass(cls, Box):
+                layer = BOXES
+            else:
+                layer = TERRAIN
+            self._layers[cls] = layer
+        return layer
+
+    def draw(self, dirty=()):
+        '''
+        (Renderer, iterable of tuple of two ints) -> None
+        Draw the cells in dirty that are in the viewport, or the whole
+        viewport if it was scrolled or refreshed, and update the display.
+        '''
+
+        self._track()
+        stage, screen = self._stage, self._screen
+        if self._loading and all(stage.is_icon_ready(f) for f in self._loading):
+            self._loading.clear()
+            self._redraw_all = True
+        view = self._viewport
+        width = stage.get_width()
+        terrain, walls, cells = stage._terrain, stage._walls, stage._cells
+        texture, layer_of = self.texture, self._layer
+        layers = ([], [], [], [], [])
+
+        if self._redraw_all:
+            screen.fill((0, 0, 0))
+            todo = [(x, y) for y in range(view.top, view.bottom) for x in range(view.left, view.right)]
+        else:
+            todo = [(x, y) for (x, y) in dirty
+                    if view.left <= x < view.right and view.top <= y < view.bottom]
+            layers[BACKGROUND].extend((self._blank, self._rects[(y - view.top) * view.width + x - view.left])
+                                      for (x, y) in todo)
+
+        for (x, y) in todo:
+            kind = terrain[y * width + x]
+            occupant = cells.get((x, y))
+            if not kind and occupant is None:
+                continue
+            rect = self._rects[(y - view.top) * view.width + x - view.left]
+            if kind:
+                layers[TERRAIN].append((texture(walls[kind]._icon_file), rect))
+            if type(occupant) is not list:
+                occupant = () if occupant is None else (occupant,)
+            for a in occupant:
+                layers[layer_of(a)].append((texture(a._icon_file), rect))
+
+        for layer in layers:
+            if layer:
+                screen.blits(layer, doreturn=False)
+        if self._redraw_all:
+            pygame.display.flip()
+            self._redraw_all = False
+        elif todo:
+            pygame.display.update([self._rects[(y - view.top) * view.width + x - view.left]
+                                   for (x, y) in todo])
@@ -0,0 +1,177 @@
+'''
+Record games and replay them, headless and as fast as possible.
+
+A recording holds the seed the board was built from and, tick by tick, the
+keys that were passed to Stage.player_event. Since the board and the game
+are deterministic, that is enough to reproduce the game exactly.
+
+    python wwgame.py --seed 7 --record game.wwr
+    python wwreplay.py game.wwr [--ticks N]
+
+The file is a header, struct HEADER, followed by records of unsigned
+varints: the number of ticks stepped since the previous record, the number
+of keys, and the keys, which are passed to the player before the next
+tick. A record without keys ends the file; a recording that was never
+closed is replayed up to its last complete record.
+'''
+
+import argparse, json, random, struct, time
+
+import ww
+
+MAGIC = b'WWRP'
+VERSION = 3 # 1: old wwgame.build boards, 2: players only kept their last key
+HEADER = struct.Struct('<4sBIIIQ') # magic, version, width, height, icon dimension, seed
+
+def write_varint(f, n):
+    '''
+    (file, int) -> None
+    Write the unsigned integer n to f, 7 bits per byte.
+    '''
+
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    f.write(out)
+
+def read_varint(f):
+    '''
+    (file) -> int
+    Read an unsigned integer written by write_varint from f.
+    '''
+
+    n = shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise EOFError('recording ends in the middle of a record')
+        n |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return n
+        shift += 7
+
+class Recorder(ww.StageWrapper):
+    '''
+    Records a game played on a Stage. A Recorder can be used wherever the
+    Stage is stepped (for example, given to a GameLoop): it passes everything
+    on to the Stage, and writes down the keys and the ticks.
+    '''
+
+    def __init__(self, stage, seed, path):
+        '''
+        (Recorder, Stage, int, str) -> None
+        Start recording the game on stage, whose board was built from seed,
+        into the file path.
+        '''
+
+        super().__init__(stage)
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, stage.get_width(),
+                                     stage.get_height(), stage._icon_dimension, seed))
+        self._keys = [] # keys received since the last tick
+        self._ticks = 0 # ticks since the last record
+
+    def player_event(self, event):
+        '''
+        (Recorder, int) -> None
+        Send a key to the player of the stage, and record it.
+        '''
+
+        super().player_event(event)
+        self._keys.append(event)
+
+    def step(self):
+        '''
+        (Recorder) -> None
+        Step the stage, and record the tick.
+        '''
+
+        if self._keys:
+            self._write(self._keys)
+            self._keys = []
+        super().step()
+        self._ticks += 1
+
+    def _write(self, keys):
+        '''
+        (Recorder, list of int) -> None
+        Write a record: the ticks since the last one, and keys.
+        '''
+
+        write_varint(self._file, self._ticks)
+        write_varint(self._file, len(keys))
+        for key in keys:
+            write_varint(self._file, key)
+        self._ticks = 0
+
+    def close(self):
+        '''
+        (Recorder) -> None
+        Finish the recording.
+        '''
+
+        if not self._file.closed:
+            self._write([])
+            self._file.close()
+
+def replay(path, build=None, max_ticks=None, step=None):
+    '''
+    (str, function, int, function) -> (Stage, int)
+    Replay the recording in path on a new headless Stage, without drawing or
+    waiting, and return the Stage and the number of ticks run. The board is
+    made by build(stage, rng), wwgame.build by default, with a generator
+    seeded like the recorded one. Stop after max_ticks ticks if given.
+    step(stage) returns the function to step the stage with, Stage.step
+    by default (a wwvector.MonsterEngine's step would do too).
+    '''
+
+    if build is None:
+        import wwgame
+        build = wwgame.build
+    with open(path, 'rb') as f:
+        magic, version, width, height, dimension, seed = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a recording this version can replay' % path)
+        stage = ww.Stage(width, height, dimension, headless=True, icons=False)
+        build(stage, random.Random(seed))
+        tick = stage.step if step is None else step(stage)
+
+        ticks = 0
+        while max_ticks is None or ticks < max_ticks:
+            try:
+                gap = read_varint(f)
+            except EOFError: # the recording was never closed, play what is there
+                break
+            if max_ticks is not None:
+                gap = min(gap, max_ticks - ticks)
+            for i in range(gap):
+                tick()
+            ticks += gap
+            count = read_varint(f)
+            if count == 0:
+                break
+            for i in range(count):
+                stage.player_event(read_varint(f))
+    return stage, ticks
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded game headless, as fast as possible.')
+    parser.add_argument('recording')
+    parser.add_argument('--ticks', type=int, help='stop after this many ticks')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stage, ticks = replay(args.recording, max_ticks=args.ticks)
+    elapsed = time.perf_counter() - start
+    actors = stage.get_actors()
+    print(json.dumps({'recording': args.recording,
+                      'ticks': ticks,
+                      'seconds': elapsed,
+                      'ticks_per_second': ticks / elapsed if elapsed else None,
+                      'monsters_left': sum(isinstance(a, ww.Monster) for a in actors),
+                      'player_alive': stage._player in actors}, indent=2))
+
+if __name__ == '__main__':
+    main()
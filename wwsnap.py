@@ -0,0 +1,290 @@
+'''
+Snapshots of a Stage, to undo moves or roll a search back.
+
+A History follows the state of every actor on a Stage: where it is,
+whether it is on the stage, its delay count, a Monster's direction and
+whether it is stuck in a sticky, and whether a KeyboardPlayer was caught.
+The state of an actor is one struct RECORD, 17 bytes.
+
+mark() remembers the current state, and undo() goes back to the state at
+the latest mark, and to the mark before it each time it is called again.
+A mark only stores the old records of the actors that changed since the
+previous mark: the actors the Stage placed or took off a cell, and the
+actors that step (a Monster's delay count changes every tick). So marking
+and undoing cost time and memory in proportion to the actors that change,
+not to the size of the board.
+
+    history = History(stage)
+    while playing:
+        history.mark()
+        stage.step()
+        if undo_pressed:
+            history.undo()
+
+snapshot() returns the whole state as bytes, and restore() goes back to
+one later on, for tools that jump between states, such as a search.
+put() only sets the actors whose records it is given, for a search that
+knows which records differ between the state it is in and the next one.
+Keys a KeyboardPlayer has not acted on yet are not part of the state.
+
+An Undoable plays a Stage with an undo key, marking the state before
+every tick in which the player was sent a key:
+
+    GameLoop(Undoable(stage)).run()
+'''
+
+import collections, struct
+
+import ww
+
+RECORD = struct.Struct('<IiiHbbB') # order number, x, y, delay count, dx, dy, flags
+
+# record flags
+ON_STAGE = 1 # the actor is on the stage
+INSIDE_STICKY = 2 # a Monster stuck in a sticky
+DEAD = 4 # a KeyboardPlayer that was caught
+
+class History:
+    '''
+    Marks states of a Stage, to go back to them. See the module docstring.
+    '''
+
+    def __init__(self, stage, limit=None):
+        '''
+        (History, Stage, int) -> None
+        Start following stage, keeping at most limit marks (all of them by
+        default). Only one History can follow a Stage at a time, and actors
+        added to it with populate after this are not followed.
+        '''
+
+        if stage._changed is not None:
+            raise ValueError('the stage already has a History')
+        self._stage = stage
+        self._marks = collections.deque(maxlen=limit) # the old records at each mark, oldest first
+        self._actors = {} # order number -> actor, for every actor seen on the stage
+        self._seqs = {} # actor -> its order number
+        self._records = {} # order number -> the record of the actor's current state
+        self._pending = {} # order number -> the record at the latest mark, of actors changed since
+        for a in stage.get_actors():
+            self._actors[a._seq], self._seqs[a] = a, a._seq
+            self._records[a._seq] = self._pack(a, a._seq)
+        stage._changed = set()
+
+    def close(self):
+        '''
+        (History) -> None
+        Stop following the stage.
+        '''
+
+        self._stage._changed = None
+
+    def __len__(self):
+        '''
+        (History) -> int
+        Return the number of marks that undo can go back to.
+        '''
+
+        return len(self._marks)
+
+    def _pack(self, actor, seq):
+        '''
+        (History, Actor, int) -> bytes
+        Return the record of the state of actor, whose order number is seq.
+        '''
+
+        flags = 0
+        if actor._seq is not None:
+            flags |= ON_STAGE
+        if getattr(actor, 'inside_sticky', False):
+            flags |= INSIDE_STICKY
+        if getattr(actor, '_dead', False):
+            flags |= DEAD
+        return RECORD.pack(seq, actor._x, actor._y, actor._delay_count,
+                           getattr(actor, '_dx', 0), getattr(actor, '_dy', 0), flags)
+
+    def _update(self):
+        '''
+        (History) -> None
+        Bring the records of the actors that changed up to date, keeping
+        their records at the latest mark in self._pending.
+        '''
+
+        stage = self._stage
+        changed = stage._changed
+        changed.update(stage._active)
+        for a in changed:
+            seq = self._seqs.get(a)
+            if seq is None:
+                seq = a._seq
+                if seq is None: # came and went since the latest mark
+                    continue
+                self._actors[seq], self._seqs[a] = a, seq
+                # it was not on the stage
+                self._records[seq] = RECORD.pack(seq, a._x, a._y, 0, 0, 0, 0)
+            record = self._pack(a, seq)
+            if record != self._records[seq]:
+                self._pending.setdefault(seq, self._records[seq])
+                self._records[seq] = record
+        changed.clear()
+
+    def mark(self):
+        '''
+        (History) -> None
+        Remember the current state of the stage.
+        '''
+
+        self._update()
+        self._marks.append(b''.join(self._pending.values()))
+        self._pending.clear()
+
+    def changes(self):
+        '''
+        (History) -> list of (bytes, bytes)
+        Return the record at the latest mark and the current record of
+        every actor whose state changed since then.
+        '''
+
+        self._update()
+        records = self._records
+        return [(old, records[seq]) for seq, old in self._pending.items() if old != records[seq]]
+
+    def undo(self):
+        '''
+        (History) -> bool
+        Go back to the state at the latest mark, or if nothing changed
+        since then, to the state at the mark before it, which is then
+        forgotten. Return False if there is no state to go back to.
+        '''
+
+        self._update()
+        if self._pending:
+            records = b''.join(self._pending.values())
+            self._pending.clear()
+        elif self._marks:
+            records = self._marks.pop()
+        else:
+            return False
+        self._apply(records)
+        for i in range(0, len(records), RECORD.size):
+            self._records[RECORD.unpack_from(records, i)[0]] = records[i:i + RECORD.size]
+        self._stage._changed.clear()
+        return True
+
+    def snapshot(self):
+        '''
+        (History) -> bytes
+        Return the state of every actor seen on the stage, for restore.
+        '''
+
+        self._update()
+        return b''.join(self._records.values())
+
+    def restore(self, snapshot):
+        '''
+        (History, bytes) -> None
+        Go back to the state of the stage when snapshot was taken. Actors
+        that came on the stage since then are taken off. Like any change,
+        this can be undone.
+        '''
+
+        self._update()
+        records, known = [snapshot], set()
+        for i in range(0, len(snapshot), RECORD.size):
+            known.add(RECORD.unpack_from(snapshot, i)[0])
+        for seq, record in self._records.items():
+            if seq not in known and RECORD.unpack(record)[6] & ON_STAGE:
+                a = self._actors[seq]
+                records.append(RECORD.pack(seq, a._x, a._y, 0, 0, 0, 0))
+        self.put(b''.join(records))
+
+    def put(self, records):
+        '''
+        (History, bytes) -> None
+        Put the actors whose records, as in a snapshot, are in records in
+        the state they record, leaving the other actors alone. Like any
+        change, this can be undone.
+        '''
+
+        self._update()
+        current = self._records
+        changed = [records[i:i + RECORD.size] for i in range(0, len(records), RECORD.size)
+                   if records[i:i + RECORD.size] != current[RECORD.unpack_from(records, i)[0]]]
+        records = b''.join(changed)
+        self._apply(records)
+        # the next mark or undo sees what changed
+        self._stage._changed.update(self._actors[seq] for (seq, *rest) in RECORD.iter_unpack(records))
+
+    def _apply(self, records):
+        '''
+        (History, bytes) -> None
+        Put the actors in records in the state they record.
+        '''
+
+        stage = self._stage
+        for seq, x, y, count, dx, dy, flags in RECORD.iter_unpack(records):
+            a = self._actors[seq]
+            if a._seq is not None and not flags & ON_STAGE:
+                stage.remove_actor(a)
+            if a.get_position() != (x, y):
+                a.set_position(x, y)
+            if a._seq is None and flags & ON_STAGE:
+                stage._insert(a, seq)
+            a._delay_count = count
+            if hasattr(a, '_dx'):
+                a._dx, a._dy = dx, dy
+                a.inside_sticky = bool(flags & INSIDE_STICKY)
+            if hasattr(a, '_dead'):
+                a._dead = bool(flags & DEAD)
+
+class Undoable(ww.StageWrapper):
+    '''
+    Plays a Stage with an undo key. An Undoable can be used wherever the
+    Stage is stepped (for example, given to a GameLoop): it passes
+    everything on to the Stage, except the undo key, which takes the game
+    back to before the latest move of the player, and further back each
+    time it is pressed again.
+    '''
+
+    def __init__(self, stage, key=ord('u'), limit=1000):
+        '''
+        (Undoable, Stage, int, int) -> None
+        Play stage, going back at most limit moves when key (a pygame key
+        code, pygame.K_u by default) is pressed.
+        '''
+
+        super().__init__(stage)
+        self._history = History(stage, limit)
+        self._key = key
+        self._moved = False # the player was sent a key since the last tick
+
+    def player_event(self, event):
+        '''
+        (Undoable, int) -> None
+        Undo if event is the undo key, else send it to the player.
+        '''
+
+        if event == self._key:
+            self._history.undo()
+            self._moved = False
+        else:
+            super().player_event(event)
+            self._moved = True
+
+    def step(self):
+        '''
+        (Undoable) -> None
+        Mark the state if the player is about to move, then step the stage.
+        '''
+
+        if self._moved:
+            self._history.mark()
+            self._moved = False
+        super().step()
+
+    def close(self):
+        '''
+        (Undoable) -> None
+        Stop following the stage.
+        '''
+
+        self._history.close()
@@ -0,0 +1,440 @@
+'''
+Find out whether, and in how few ticks, the player can trap every Monster
+of a board, by searching the games that can be played on it.
+
+A state of the search is the state of a headless copy of the Stage at
+the start of a tick. Its children are the states after the tick that
+follows each of the 9 things the player can do: one of the moves of
+KEY_MOVES, or nothing. The children are made by the game itself: the key
+goes through Stage.player_event and the tick is Stage.step, so pushes,
+stickies and dying Monsters work exactly as in a game. A wwsnap.History
+takes the copy back to the parent after each child. A state is a win
+once no Monster is left on the stage; states where the player was
+caught are dropped.
+
+The search is breadth first ('bfs'), so the first win found takes as
+few ticks as possible, or best first ('best'), weighted A* style: a
+state's ticks plus weight times its estimate of how far it is from a
+win. A Monster that is not stuck in a sticky goes where the board
+sends it, so the estimate follows each Monster left over the next
+HORIZON ticks, as if nothing else moved (monster_path), and takes the
+cell on its way that is cheapest to trap it in: 4 for each empty cell
+around it, but for the one it came from, which the player can step
+into, plus the distance from the player. Best first also drops the
+states waiting to be searched as soon as one with fewer Monsters left
+turns up, and goes on from there. That finds a win on bigger boards
+sooner, but maybe not the shortest one.
+
+States are hashed Zobrist style: every actor's place and every other
+part of its state gets a random 64 bit key, and the hash of a state is
+the XOR of them all, so the hash of a child is worked out from its
+parent's and the records that changed in the tick. The hashes of the
+states seen go in a transposition table of table_size slots. A state
+whose hash is already in its slot is not searched again. When two
+hashes share a slot the newer one takes it, so the memory used stays
+the same however long the search, at the cost of maybe searching a
+state twice. A state waiting to be searched only keeps the wwsnap
+records that differ from the board at the start, and going from one
+state to the next only sets the actors that differ between the two.
+
+A move that pushes a Box onto a dead cell is pruned. A dead cell is one
+where walls and the edges of the stage keep a Box from ever being pushed
+again, and that is not next to any cell where a Monster can be trapped.
+
+A Monster on the edge of the stage or off it can not be trapped there.
+On the wwgame.py boards one starts off the stage, at (5, 20), but it
+soon bounces in. The wins found on those boards take 50 to 80 ticks,
+far too deep for breadth first. Best first with weight 2 wins 15 of the
+boards of seeds 0 to 19 within 30 seconds each, half of them within 11
+seconds, here (python wwbench.py solve --time-limit 30).
+
+    result = wwsolve.solve(stage, strategy='best')
+
+    python wwsolve.py --seed 7 --strategy best --weight 2 # the wwgame.py board of seed 7
+    python wwsolve.py level.wwl [--max-ticks N] [--max-nodes N]
+'''
+
+import argparse, array, collections, heapq, json, os, random, tempfile, time
+
+import ww, wwlevel, wwsnap
+
+# what the player can do in a tick: nothing, or a move key
+ACTIONS = (None,) + tuple(ww.KEY_MOVES)
+NOTHING = '.' # how doing nothing is written in a path, moves are their key
+HORIZON = 12 # ticks the estimate of best first follows each Monster for
+
+def copy_stage(stage):
+    '''
+    (Stage) -> Stage
+    Return a headless copy of stage, without images, that plays on
+    exactly like it. Keys the player has not acted on yet are not copied.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stage.wwl')
+        wwlevel.save(stage, path)
+        return wwlevel.load(path, headless=True, icons=False)
+
+def dead_cells(stage):
+    '''
+    (Stage) -> bytearray
+    Return, for each cell of stage row by row, 1 if it is dead and 0 if
+    not. See the module docstring.
+    '''
+
+    width, height = stage.get_width(), stage.get_height()
+
+    def blocked(x, y): # for good
+        return not stage.is_in_bounds(x, y) or stage.is_wall(x, y)
+
+    def trap(x, y): # a Monster there can have all 8 neighbours filled
+        return 0 < x < width - 1 and 0 < y < height - 1 and not stage.is_wall(x, y)
+
+    dead = bytearray(width * height)
+    for y in range(height):
+        for x in range(width):
+            if blocked(x, y):
+                continue
+            frozen = all(blocked(x - dx, y - dy) or blocked(x + dx, y + dy)
+                         for (dx, dy) in ww.KEY_MOVES.values())
+            if frozen and not any(trap(x + dx, y + dy) for (dx, dy) in ww.KEY_MOVES.values()):
+                dead[y * width + x] = 1
+    return dead
+
+def monster_path(stage, monster, ticks):
+    '''
+    (Stage, Monster, int) -> list of tuple of two ints
+    Return where monster on stage is now and after each of the next ticks
+    ticks, if nothing else on the stage moved. It moves by the rules of
+    Monster.step and Monster.move, and a Monster stuck in a sticky stays.
+    '''
+
+    (x, y), (dx, dy) = monster.get_position(), (monster._dx, monster._dy)
+    count, delay = monster._delay_count, monster._delay
+    cells = [(x, y)]
+    for i in range(ticks):
+        count = (count + 1) % delay
+        if count == 0 and not monster.inside_sticky:
+            nx, ny = x + dx, y + dy
+            blocked = stage.get_actor(nx, ny) not in (None, monster) # it left its cell
+            if blocked or not stage.is_in_bounds_x(nx):
+                dx = -dx
+            if blocked or not stage.is_in_bounds_y(ny):
+                dy = -dy
+            else: # like Monster.move, it goes where it was heading
+                (x, y) = (nx, ny)
+        cells.append((x, y))
+    return cells
+
+class Solver:
+    '''
+    Searches the games that can be played on a headless copy of a Stage,
+    for one where every Monster gets trapped. See the module docstring.
+    '''
+
+    def __init__(self, stage, table_size=1 << 20, seed=0):
+        '''
+        (Solver, Stage, int, int) -> None
+        Get ready to search the board on stage, which is copied and left
+        alone. It must have a KeyboardPlayer. The transposition table has
+        table_size slots, and seed seeds the Zobrist keys.
+        '''
+
+        self._stage = copy_stage(stage)
+        self._player = self._stage._player
+        if not isinstance(self._player, ww.KeyboardPlayer) or self._player._seq is None:
+            raise ValueError('the stage has no KeyboardPlayer on it')
+        self._monsters = [a for a in self._stage.get_actors() if isinstance(a, ww.Monster)]
+        self._boxes = {a._seq for a in self._stage.get_actors() if isinstance(a, ww.Box)}
+        self._history = wwsnap.History(self._stage, limit=1)
+        self._dead = dead_cells(self._stage)
+        self._table = array.array('Q', bytes(8 * table_size))
+        self._rng = random.Random(seed)
+        self._keys = {} # a part of a record -> its Zobrist key
+
+        # the board at the start, which states are kept as differences to
+        root = self._history.snapshot()
+        size = wwsnap.RECORD.size
+        self._root_records = {} # order number -> its record at the start
+        self._root_hash = 0
+        for i in range(0, len(root), size):
+            record = root[i:i + size]
+            self._root_records[wwsnap.RECORD.unpack_from(record)[0]] = record
+            self._root_hash ^= self._zobrist(record)
+        self._at = {} # the records the copy differs from the start by
+
+        self.nodes = 0 # states made
+        self.expanded = 0 # states searched
+        self.transpositions = 0 # states dropped because they were seen before
+        self.caught = 0 # states dropped because the player was caught
+        self.dead_boxes = 0 # states dropped because a Box was pushed onto a dead cell
+
+    def _zobrist(self, record):
+        '''
+        (Solver, bytes) -> int
+        Return the Zobrist key of record: the XOR of the keys of the
+        actor's place, and of the rest of its state.
+        '''
+
+        keys = self._keys
+        place, rest = record[:12], record[:4] + record[12:]
+        k1 = keys.get(place)
+        if k1 is None:
+            k1 = keys[place] = self._rng.getrandbits(64)
+        k2 = keys.get(rest)
+        if k2 is None:
+            k2 = keys[rest] = self._rng.getrandbits(64)
+        return k1 ^ k2
+
+    def _seen(self, h):
+        '''
+        (Solver, int) -> bool
+        Return True iff the state with hash h is in the transposition
+        table, and put it there if not.
+        '''
+
+        table = self._table
+        slot = h % len(table)
+        if table[slot] == h:
+            return True
+        table[slot] = h
+        return False
+
+    def _restore(self, records):
+        '''
+        (Solver, dict of int to bytes) -> None
+        Put the copy in the state that differs from the start by records
+        (order number -> record), setting only the actors that differ
+        from the state it is in.
+        '''
+
+        at = self._at
+        changed = [record for seq, record in records.items() if at.get(seq) != record]
+        changed.extend(self._root_records[seq] for seq in at if seq not in records)
+        self._history.put(b''.join(changed))
+        self._at = records
+
+    def _won(self):
+        '''
+        (Solver) -> bool
+        Return True iff no Monster is left on the copy.
+        '''
+
+        return all(m._seq is None for m in self._monsters)
+
+    def _pushed_dead_box(self, changes):
+        '''
+        (Solver, list of (bytes, bytes)) -> bool
+        Return True iff a Box was pushed onto a dead cell in the tick whose
+        changes, from History.changes, are given.
+        '''
+
+        stage, width = self._stage, self._stage.get_width()
+        for old, new in changes:
+            seq, x, y, count, dx, dy, flags = wwsnap.RECORD.unpack(new)
+            if (seq in self._boxes and old[4:12] != new[4:12] and flags & wwsnap.ON_STAGE
+                    and stage.is_in_bounds(x, y) and self._dead[y * width + x]):
+                return True
+        return False
+
+    def _estimate(self):
+        '''
+        (Solver) -> int
+        Return how far the copy looks from a win: for each Monster left,
+        the cheapest cell to trap it in on its way over the next HORIZON
+        ticks. See the module docstring.
+        '''
+
+        stage, width, height = self._stage, self._stage.get_width(), self._stage.get_height()
+        (px, py) = self._player.get_position()
+        total = 0
+        for m in self._monsters:
+            if m._seq is None:
+                continue
+            (mx, my) = m.get_position()
+            cheapest = None
+            for (x, y) in set(monster_path(stage, m, HORIZON)):
+                if not (0 < x < width - 1 and 0 < y < height - 1):
+                    continue
+                empty = 8 - stage._neighbours[y * width + x]
+                if max(abs(x - mx), abs(y - my)) == 1: # where it is now will be empty
+                    empty += 1
+                cost = 4 * (empty - 1) + max(abs(x - px), abs(y - py))
+                if cheapest is None or cost < cheapest:
+                    cheapest = cost
+            # a Monster that stays on the edge costs more than any cell
+            total += 4 * 8 + width + height if cheapest is None else cheapest
+        return total
+
+    def solve(self, strategy='bfs', max_ticks=100, max_nodes=1000000, time_limit=None, weight=1):
+        '''
+        (Solver, str, int, int, float, int) -> dict
+        Search breadth first ('bfs') or best first ('best', with weight)
+        for a win in at most max_ticks ticks, making at most max_nodes
+        states and searching for at most time_limit seconds (no limit by
+        default). Return the win found, if any, and statistics of the search.
+        '''
+
+        if strategy not in ('bfs', 'best'):
+            raise ValueError('unknown strategy %r' % (strategy,))
+        start = time.perf_counter()
+        history, player, size = self._history, self._player, wwsnap.RECORD.size
+        root_records = self._root_records
+
+        # the states made: parent, action and ticks of each, the records
+        # differing from the start of those waiting to be searched
+        parents, actions, ticks = array.array('q'), bytearray(), array.array('i')
+        deltas = []
+
+        def add(parent, action, tick, delta):
+            parents.append(parent)
+            actions.append(action)
+            ticks.append(tick)
+            deltas.append(delta)
+            self.nodes += 1
+            return len(deltas) - 1
+
+        fewest = sum(m._seq is not None for m in self._monsters) # Monsters left, best first
+        won = None
+        root = add(-1, 0, 0, b'')
+        self._seen(self._root_hash)
+        hashes = {root: self._root_hash}
+        if self._won():
+            won = root
+        if strategy == 'bfs':
+            waiting = collections.deque([root])
+            take = waiting.popleft
+        else:
+            waiting = [(weight * self._estimate(), root)]
+            take = lambda: heapq.heappop(waiting)[1]
+
+        while waiting and won is None and self.nodes < max_nodes:
+            if time_limit is not None and time.perf_counter() - start > time_limit:
+                break
+            node = take()
+            if ticks[node] >= max_ticks:
+                continue
+            delta, h = deltas[node], hashes.pop(node)
+            deltas[node] = None
+            self.expanded += 1
+            records = {wwsnap.RECORD.unpack_from(delta, i)[0]: delta[i:i + size]
+                       for i in range(0, len(delta), size)}
+            self._restore(records)
+            history.mark()
+
+            for action, key in enumerate(ACTIONS):
+                if key is not None:
+                    self._stage.player_event(key)
+                self._stage.step()
+                player._queue.clear() # left there if the player was caught before its step
+                changes = history.changes()
+
+                child_h, child = h, dict(records)
+                for old, new in changes:
+                    seq = wwsnap.RECORD.unpack_from(new)[0]
+                    child_h ^= self._zobrist(old) ^ self._zobrist(new)
+                    if new == root_records[seq]:
+                        child.pop(seq, None)
+                    else:
+                        child[seq] = new
+                if player._seq is None:
+                    self.caught += 1
+                elif self._pushed_dead_box(changes):
+                    self.dead_boxes += 1
+                elif self._seen(child_h):
+                    self.transpositions += 1
+                else:
+                    n = add(node, action, ticks[node] + 1, b''.join(child.values()))
+                    hashes[n] = child_h
+                    if self._won():
+                        won = n
+                    elif strategy == 'bfs':
+                        waiting.append(n)
+                    else:
+                        left = sum(m._seq is not None for m in self._monsters)
+                        if left < fewest:
+                            fewest = left
+                            for f, k in waiting:
+                                deltas[k] = None
+                                del hashes[k]
+                            waiting.clear()
+                        heapq.heappush(waiting, (ticks[n] + weight * self._estimate(), n))
+                if changes:
+                    history.undo()
+                if won is not None:
+                    break
+
+        elapsed = time.perf_counter() - start
+        path = None
+        if won is not None:
+            path = []
+            n = won
+            while parents[n] != -1:
+                key = ACTIONS[actions[n]]
+                path.append(NOTHING if key is None else chr(key))
+                n = parents[n]
+            path = ''.join(reversed(path))
+        return {'solved': won is not None,
+                'path': path,
+                'ticks': None if path is None else len(path),
+                'strategy': strategy,
+                'weight': weight if strategy == 'best' else None,
+                'nodes': self.nodes,
+                'expanded': self.expanded,
+                'transpositions': self.transpositions,
+                'caught': self.caught,
+                'dead_boxes': self.dead_boxes,
+                'seconds': elapsed,
+                'nodes_per_second': self.nodes / elapsed if elapsed else None,
+                'exhausted': won is None and not waiting}
+
+def solve(stage, strategy='bfs', max_ticks=100, max_nodes=1000000, time_limit=None,
+          weight=1, table_size=1 << 20):
+    '''
+    (Stage, str, int, int, float, int, int) -> dict
+    Search a copy of stage for a way to trap every Monster, with a Solver.
+    See Solver.solve.
+    '''
+
+    return Solver(stage, table_size).solve(strategy, max_ticks, max_nodes, time_limit, weight)
+
+def play(stage, path):
+    '''
+    (Stage, str) -> None
+    Play path, as returned by solve, on stage: one tick for each of its
+    characters, the key of a move or NOTHING.
+    '''
+
+    for c in path:
+        if c != NOTHING:
+            stage.player_event(ord(c))
+        stage.step()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find how to trap every Monster of a board.')
+    parser.add_argument('level', nargs='?', help='the level file to solve')
+    parser.add_argument('--seed', type=int, help='solve the wwgame.py board built from SEED instead')
+    parser.add_argument('--strategy', choices=('bfs', 'best'), default='bfs')
+    parser.add_argument('--max-ticks', type=int, default=100)
+    parser.add_argument('--max-nodes', type=int, default=1000000)
+    parser.add_argument('--time-limit', type=float, help='give up after this many seconds')
+    parser.add_argument('--weight', type=int, default=1, help='weight of the estimate for best')
+    parser.add_argument('--table-size', type=int, default=1 << 20,
+                        help='slots of the transposition table, 8 bytes each')
+    args = parser.parse_args(argv)
+    if (args.level is None) == (args.seed is None):
+        parser.error('give either a level file or --seed')
+
+    if args.seed is not None:
+        import wwgame
+        stage = ww.Stage(20, 20, 24, headless=True, icons=False)
+        wwgame.build(stage, random.Random(args.seed))
+    else:
+        stage = wwlevel.load(args.level, headless=True, icons=False)
+    result = solve(stage, args.strategy, args.max_ticks, args.max_nodes, args.time_limit,
+                   args.weight, args.table_size)
+    result.update({'level': args.level, 'seed': args.seed})
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,466 @@
+'''
+A batched engine that steps all the Monsters of a Stage with NumPy.
+
+The positions, directions and delay counters of the Monsters are kept in
+arrays, and the bounces of all Monsters are worked out at once against an
+occupancy grid of the Stage. The result is exactly what Stage.step would
+have done: Monsters whose cells another Monster may change this tick, or
+that are in any unusual situation (about to die, about to catch the
+player, far off the stage), are stepped one at a time with Monster.step,
+in stage order. So are Monsters in runs too short to be worth it.
+
+    engine = MonsterEngine(stage)
+    while playing:
+        engine.step() # instead of stage.step()
+
+The Monster objects stay on the Stage and their positions are always up
+to date, but while an engine drives a Stage their directions and delay
+counters are only written back by sync.
+'''
+
+import numpy as np
+
+from ww import Monster, KeyboardPlayer
+
+# the offsets of the 8 neighbours of a cell
+NEIGHBOURS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dx, dy) != (0, 0)]
+# the offsets of a cell and its neighbours, all a Monster looks at or changes in a step
+AROUND = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+NOBODY = np.iinfo(np.int32).max # marks cells no Monster has claimed
+# the rows of the state array of the Monsters of an engine
+X, Y, DX, DY, DELAY, COUNT, ON_STAGE, STICKY = range(8)
+ROUNDS = 8 # the most times step_run spreads uncertainty before giving up on it
+
+class MonsterEngine:
+    '''
+    Steps a Stage, doing the work of all its Monsters in bulk.
+    '''
+
+    PAD = 3 # cells of grid kept around the stage, Monsters can stray outside it
+    MIN_RUN = 32 # fewer Monsters in a row are quicker to step one by one
+
+    def __init__(self, stage):
+        '''
+        (MonsterEngine, Stage) -> None
+        Construct an engine for stage and start tracking which of its
+        cells are occupied, and which of its Monsters are on it or stuck
+        in a sticky.
+        '''
+
+        self._stage = stage
+        self._width, self._height = stage.get_width(), stage.get_height()
+        shape = (self._height + 2*self.PAD, self._width + 2*self.PAD)
+        self._occupied = np.zeros(shape, bool)
+        # scratch grids for step_run
+        self._scratch = tuple(np.full(shape, NOBODY, np.int32) for i in range(3))
+        pad, w, h = self.PAD, self._width, self._height
+        terrain = np.frombuffer(stage._terrain, np.uint8).reshape(h, w)
+        self._occupied[pad:pad+h, pad:pad+w] = terrain != 0
+        self._changes = dict.fromkeys(stage._cells, True)
+        stage.add_cell_listener(self._mark)
+        self._touched = set() # actors that came, went or got stuck since the last run
+        stage.add_actor_listener(self._touched.add)
+
+        self._monsters = []
+        self._seen_seq = None
+        self._rebuild()
+
+    def _mark(self, x, y, occupied):
+        '''
+        (MonsterEngine, int, int, bool) -> None
+        Note that cell (x, y) became occupied or empty. The grid is brought
+        up to date in one go by _update, just before it is needed.
+        '''
+
+        self._changes[(x, y)] = occupied
+
+    def _update(self):
+        '''
+        (MonsterEngine) -> None
+        Apply the noted changes of the stage to the occupancy grid, and
+        the comings and goings of Monsters to the state array.
+        '''
+
+        if self._touched:
+            index, state = self._index, self._state
+            for a in self._touched:
+                i = index.get(a)
+                if i is not None:
+                    state[ON_STAGE, i] = a._seq is not None
+                    state[STICKY, i] = a.inside_sticky
+            self._touched.clear()
+
+        if not self._changes:
+            return
+        latest, self._changes = self._changes, {}
+        cells = np.array(list(latest), np.int64).reshape(-1, 2) + self.PAD
+        occupied = np.fromiter(latest.values(), bool, len(latest))
+        gx, gy = cells[:, 0], cells[:, 1]
+        on_grid = (gx >= 0) & (gx < self._occupied.shape[1]) & \
+                  (gy >= 0) & (gy < self._occupied.shape[0])
+        self._occupied[gy[on_grid], gx[on_grid]] = occupied[on_grid]
+
+    def _rebuild(self):
+        '''
+        (MonsterEngine) -> None
+        Work out the order in which things happen in a tick of the stage:
+        a plan made of the Actors to step one by one, and of runs of at
+        least MIN_RUN consecutive Monsters, given as (start, stop) ranges
+        of the state array.
+        '''
+
+        self.sync()
+        self._monsters, self._plan, players = [], [], []
+        run = []
+        for a in self._stage._active + [None]:
+            if type(a) is Monster:
+                run.append(a)
+                continue
+            if len(run) >= self.MIN_RUN:
+                self._plan.append((len(self._monsters), len(self._monsters) + len(run)))
+                self._monsters.extend(run)
+            else:
+                self._plan.extend(run)
+            run = []
+            if a is not None:
+                self._plan.append(a)
+            if isinstance(a, KeyboardPlayer):
+                players.append(a)
+        self._players = players
+
+        monsters = self._monsters
+        self._index = {m: i for i, m in enumerate(monsters)}
+        self._state = self._new_state(len(monsters))
+        self._state[:] = [[m._x for m in monsters], [m._y for m in monsters],
+                          [m._dx for m in monsters], [m._dy for m in monsters],
+                          [m._delay for m in monsters], [m._delay_count for m in monsters],
+                          [m._seq is not None for m in monsters],
+                          [m.inside_sticky for m in monsters]]
+        self._touched.clear()
+        self._seen_seq = self._stage._next_seq
+
+    def _new_state(self, n):
+        '''
+        (MonsterEngine, int) -> numpy.ndarray
+        Return a new state array for n Monsters, one column each with the
+        rows X, Y, DX, DY, DELAY, COUNT, ON_STAGE and STICKY.
+        '''
+
+        return np.zeros((8, n), np.int64)
+
+    def sync(self):
+        '''
+        (MonsterEngine) -> None
+        Write the directions and delay counters kept by this engine back
+        into the Monster objects.
+        '''
+
+        if not self._monsters:
+            return
+        dx, dy, count = self._state[[DX, DY, COUNT]].tolist()
+        for m, mdx, mdy, c in zip(self._monsters, dx, dy, count):
+            m._dx, m._dy, m._delay_count = mdx, mdy, c
+
+    def step(self):
+        '''
+        (MonsterEngine) -> None
+        Take one step of the stage, exactly like Stage.step.
+        '''
+
+        if self._stage._next_seq != self._seen_seq: # actors were added
+            self._rebuild()
+        for item in self._plan:
+            if type(item) is tuple:
+                self._step_run(*item)
+            elif item._seq is not None:
+                item.step()
+
+    def _step_run(self, start, stop):
+        '''
+        (MonsterEngine, int, int) -> None
+        Step the Monsters start..stop-1, which come one after another in
+        the stage order: the ones step_run is sure of in bulk, the rest
+        one by one with Monster.step, in order, after them.
+        '''
+
+        self._update()
+        before = self._state[[X, Y], start:stop]
+        unsure, moved = self._step_arrays(start, stop)
+        self._move(start, np.flatnonzero(moved), before)
+
+        unsure = np.flatnonzero(unsure) + start
+        state, monsters, after = self._state, self._monsters, []
+        for i, (mdx, mdy, c) in zip(unsure.tolist(), state[[DX, DY, COUNT]][:, unsure].T.tolist()):
+            m = monsters[i]
+            if m._seq is not None:
+                m._dx, m._dy, m._delay_count = mdx, mdy, c
+                m.step()
+            after.append((m._x, m._y, m._dx, m._dy, m._delay, m._delay_count,
+                          m._seq is not None, m.inside_sticky))
+        if after:
+            state[:, unsure] = np.array(after, np.int64).T
+
+    def _step_arrays(self, start, stop):
+        '''
+        (MonsterEngine, int, int) -> (numpy.ndarray, numpy.ndarray)
+        Do step_run on the state of the Monsters start..stop-1 and return
+        its answer. Subclasses can share this work out.
+        '''
+
+        return step_run(self._occupied, self._state[:, start:stop], np.arange(stop - start),
+                        self._player_cells(), (self._width, self._height), self._scratch)
+
+    def _player_cells(self):
+        '''
+        (MonsterEngine) -> list of tuple
+        Return the cells of the players on the stage.
+        '''
+
+        return [(p._x, p._y) for p in self._players if p._seq is not None]
+
+    def _move(self, start, moved, before):
+        '''
+        (MonsterEngine, int, numpy.ndarray, numpy.ndarray) -> None
+        Move the Monsters start+moved, which were at before[:, moved], to
+        the positions in the state array, keeping the stage up to date.
+
+        This is what Actor.set_position does, but done for all of them at
+        once: only the cell index has to be changed one Monster at a time.
+        So it is only done when nobody else listens to the cells of the
+        stage, and for Monsters alone in their cell.
+        '''
+
+        if not len(moved):
+            return
+        stage, monsters = self._stage, self._monsters
+        ox, oy = before[:, moved]
+        nx, ny = self._state[X:Y+1, moved + start]
+        w, h = self._width, self._height
+        on_stage = (ox >= 0) & (ox < w) & (oy >= 0) & (oy < h)
+        # Monsters leaving a Wall's cell keep it occupied, leave them to set_position
+        slow = np.zeros(len(moved), bool)
+        slow[on_stage] = np.frombuffer(stage._terrain, np.uint8)[(oy*w + ox)[on_stage]] != 0
+        if len(stage._cell_listeners) > 1 or stage._trap_listeners:
+            slow[:] = True # they want to hear about every change as it happens
+
+        cells, fast = stage._cells, np.zeros(len(moved), bool)
+        olds, news = zip(ox.tolist(), oy.tolist()), zip(nx.tolist(), ny.tolist())
+        for j, (i, old, new, by_hand) in enumerate(zip((moved + start).tolist(), olds, news,
+                                                       slow.tolist())):
+            m = monsters[i]
+            if not by_hand and cells.get(old) is m:
+                del cells[old]
+                cells[new] = m
+                (m._x, m._y) = new
+                fast[j] = True
+            else:
+                m.set_position(*new)
+
+        # what _unplace and _place would have done for the fast ones
+        ox, oy, nx, ny = ox[fast], oy[fast], nx[fast], ny[fast]
+        counts = np.frombuffer(stage._neighbours, np.uint8)
+        for (cx, cy), change in ((ox, oy), np.subtract), ((nx, ny), np.add):
+            x = np.concatenate([cx + dx for (dx, dy) in NEIGHBOURS])
+            y = np.concatenate([cy + dy for (dx, dy) in NEIGHBOURS])
+            inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+            at = (y*w + x)[inside]
+            change.at(counts, at, np.ones(len(at), np.uint8))
+        pad = self.PAD
+        self._occupied[oy + pad, ox + pad] = False
+        self._occupied[ny + pad, nx + pad] = True
+        if stage._screen is not None:
+            stage._dirty.update(zip(ox.tolist(), oy.tolist()), zip(nx.tolist(), ny.tolist()))
+        if stage._changed is not None:
+            stage._changed.update(monsters[i] for i in (moved[fast] + start).tolist())
+
+def step_run(occupied, state, order, players, size, scratch, forced=None):
+    '''
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, list, tuple, tuple, numpy.ndarray) -> (numpy.ndarray, numpy.ndarray)
+    Step the Monsters whose state arrays (see MonsterEngine._new_state)
+    are the columns of state and whose places in the stage order are
+    order, on a stage of size (width, height) whose cells, and the
+    MonsterEngine.PAD cells around it, are in the occupancy grid occupied.
+    players are the cells of the players.
+
+    Every Monster is worked out as if it were alone on the board as it
+    was at the start. That answer is right unless an earlier Monster
+    changed the cells it depends on, or it could change the cells an
+    earlier Monster that is not sure depends on. The state of the sure
+    Monsters is changed in place; return (unsure, moved), the Monsters to
+    step one by one with Monster.step, in order, after the sure ones, and
+    the sure Monsters that moved. forced marks more Monsters as unsure.
+    scratch is three grids shaped like occupied and full of NOBODY, they
+    are left that way.
+    '''
+
+    x, y, dx, dy, delay, count, on_stage, sticky = state
+    on_stage = on_stage != 0
+    (w, h), pad = size, (occupied.shape[1] - size[0]) // 2
+
+    # everything within 2 of a Monster at these positions is on the grid
+    in_range = (x >= 2-pad) & (x < w+pad-2) & (y >= 2-pad) & (y < h+pad-2)
+    gx = np.where(in_range, x + pad, pad)
+    gy = np.where(in_range, y + pad, pad)
+    tgx, tgy = gx + dx, gy + dy
+
+    # what each Monster does on the board as it was at the start
+    neighbours = gather(occupied, gx, gy, NEIGHBOURS)
+    blocked = occupied[tgy, tgx]
+    new_count = (count + 1) % delay
+    fires = (new_count == 0) & (sticky == 0)
+    tx, ty = x + dx, y + dy
+    bounce_x = fires & ((tx < 0) | (tx >= w) | blocked)
+    bounce_y = fires & ((ty < 0) | (ty >= h) | blocked)
+    moves = on_stage & fires & ~bounce_y
+    catches = np.zeros(len(x), bool)
+    for (px, py) in players:
+        catches |= fires & (tx == px) & (ty == py)
+
+    # Monsters off the grid, dying or catching the player are rare,
+    # leave them to Monster.step
+    unsure = on_stage & (~in_range | (neighbours == 8) | catches)
+    if forced is not None:
+        unsure |= on_stage & forced
+
+    # so are the ones heading for a cell an earlier Monster moves into
+    # or out of, and the ones earlier Monsters could surround
+    filled, emptied, uncertain = scratch
+    movers = moves & in_range
+    sources, targets = (gy[movers], gx[movers]), (tgy[movers], tgx[movers])
+    claim(emptied, sources, order[movers])
+    claim(filled, targets, order[movers])
+    unsure |= on_stage & fires & (np.minimum(filled[tgy, tgx], emptied[tgy, tgx]) < order)
+    c = np.flatnonzero(on_stage & ~unsure & (spread(filled)[gy, gx] < order))
+    unsure[c] = neighbours[c] + earlier((filled,), gx[c], gy[c], order[c]) >= 8
+
+    # an unsure Monster could change anything around it: a later Monster
+    # that depends on those cells, or that changes them, is unsure too
+    stamped = []
+    new = np.flatnonzero(unsure)
+    for i in range(ROUNDS):
+        if not len(new):
+            break
+        cells = (np.clip(np.concatenate([y[new] + pad + oy for (ox, oy) in AROUND]),
+                         0, occupied.shape[0] - 1),
+                 np.clip(np.concatenate([x[new] + pad + ox for (ox, oy) in AROUND]),
+                         0, occupied.shape[1] - 1))
+        claim(uncertain, cells, np.tile(order[new], len(AROUND)))
+        stamped.append(cells)
+        # only Monsters next to an uncertain cell can be affected
+        c = np.flatnonzero(on_stage & ~unsure & (spread(uncertain)[gy, gx] < order))
+        o, cx, cy = order[c], gx[c], gy[c]
+        more = (fires[c] & (uncertain[tgy[c], tgx[c]] < o)) | \
+               (movers[c] & (uncertain[cy, cx] < o)) | \
+               (neighbours[c] + earlier((filled, uncertain), cx, cy, o) >= 8)
+        new = c[more]
+        unsure[new] = True
+    else:
+        if len(new): # give up: anything after the first new one could depend on it
+            unsure |= on_stage & (order > order[new].min())
+    emptied[sources] = filled[targets] = NOBODY
+    for cells in stamped:
+        uncertain[cells] = NOBODY
+
+    # the sure Monsters: bounce off anything in the way, like Monster.move
+    sure = on_stage & ~unsure
+    count[sure] = new_count[sure]
+    moved = sure & moves
+    x[moved] = tx[moved]
+    y[moved] = ty[moved]
+    flip = sure & bounce_x
+    dx[flip] = -dx[flip]
+    flip = sure & bounce_y
+    dy[flip] = -dy[flip]
+    return unsure, moved
+
+def gather(grid, gx, gy, offsets, combine=np.add):
+    '''
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, list, numpy.ufunc) -> numpy.ndarray
+    Return, for each grid position (gx, gy), the values of grid at the
+    given offsets around it, combined with combine (a sum by default).
+    '''
+
+    (ox, oy), rest = offsets[0], offsets[1:]
+    total = grid[gy + oy, gx + ox].astype(np.int64)
+    for (ox, oy) in rest:
+        combine(total, grid[gy + oy, gx + ox], out=total)
+    return total
+
+def claim(grid, cells, values):
+    '''
+    (numpy.ndarray, tuple, numpy.ndarray) -> None
+    Lower each of the cells (rows, columns) of grid to the matching one
+    of values, if that is smaller.
+    '''
+
+    np.minimum.at(grid.reshape(-1), cells[0] * grid.shape[1] + cells[1], values.astype(grid.dtype))
+
+def spread(grid):
+    '''
+    (numpy.ndarray) -> numpy.ndarray
+    Return a grid holding, for each cell, the smallest value of grid
+    in that cell and its neighbours.
+    '''
+
+    out = grid.copy()
+    np.minimum(out[1:], grid[:-1], out=out[1:])
+    np.minimum(out[:-1], grid[1:], out=out[:-1])
+    rows = out.copy()
+    np.minimum(out[:, 1:], rows[:, :-1], out=out[:, 1:])
+    np.minimum(out[:, :-1], rows[:, 1:], out=out[:, :-1])
+    return out
+
+def earlier(grids, gx, gy, order):
+    '''
+    (tuple, numpy.ndarray, numpy.ndarray, numpy.ndarray) -> numpy.ndarray
+    Return, for each grid position (gx, gy), how many of its neighbours
+    hold a number smaller than order in one of grids.
+    '''
+
+    total = np.zeros(len(gx), np.int64)
+    for (ox, oy) in NEIGHBOURS:
+        cells = (gy + oy, gx + ox)
+        first = grids[0][cells]
+        for grid in grids[1:]:
+            first = np.minimum(first, grid[cells])
+        total += first < order
+    return total
+
+def monster_state(stage):
+    '''
+    (Stage) -> list
+    Return everything about the actors of stage that a step can change.
+    '''
+
+    return [(a.get_position(), getattr(a, '_dx', None), getattr(a, '_dy', None),
+             getattr(a, '_delay_count', None), getattr(a, 'inside_sticky', None))
+            for a in stage.get_actors()]
+
+def cross_check(build, ticks, input_rate=0.5, keys=None, engine=MonsterEngine):
+    '''
+    (function, int, float, list, function) -> int
+    Check that a MonsterEngine and Stage.step agree. build() must return a
+    new (Stage, random.Random) pair and give the same board every time.
+    One board is stepped by Stage.step, the other by engine(stage), both
+    getting the same random key presses from keys, and their actors are
+    compared after every tick. Raise AssertionError at the first difference,
+    otherwise return the number of ticks checked.
+    '''
+
+    stage, rng = build()
+    fast_stage, fast_rng = build()
+    fast = engine(fast_stage)
+    for tick in range(ticks):
+        if keys and rng.random() < input_rate:
+            key = rng.choice(keys)
+            stage.player_event(key)
+            fast_stage.player_event(key)
+        stage.step()
+        fast.step()
+        fast.sync()
+        if monster_state(stage) != monster_state(fast_stage):
+            raise AssertionError('%s differs from Stage.step at tick %d'
+                                 % (type(fast).__name__, tick))
+    if hasattr(fast, 'close'):
+        fast.close()
+    return ticks
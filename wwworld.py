@@ -0,0 +1,299 @@
+'''
+Play a world too big to keep on a Stage, by loading it chunk by chunk.
+
+A world is a directory written by split, holding:
+
+- world.json: the version and the chunk size;
+- world.wwl: a level file (see wwlevel) with the terrain of the whole
+  world and the player, but no other actors;
+- chunk-CX-CY.wwc: the actors of the chunk (CX, CY), the square of
+  chunk_size by chunk_size cells whose top left cell is
+  (CX*chunk_size, CY*chunk_size), as a struct CHUNK header followed by a
+  palette and ENTITY records like in a level file. Chunks without actors
+  have no file.
+
+A World plays it. The terrain, one byte per cell, and the player stay on
+the Stage; the actors of a chunk are loaded when the player comes within
+radius chunks of it. Around the player's chunk, the chunks within
+active_radius are stepped every tick, the rest of the loaded square but
+its outer ring every slow_every ticks (never if slow_every is 0), and the
+others are frozen. Since the outer ring is never stepped, whatever moves
+always has loaded chunks all around it. Chunks the player went away from
+stay loaded, frozen, until there are more than max_chunks; then the ones
+left behind longest ago are written back to their files and unloaded.
+So the memory and the tick cost depend on the radii, not on the size of
+the world.
+
+An actor belongs to the chunk its cell is in, and a Monster that wandered
+off the stage to the nearest chunk. A line of Boxes pushed past the
+loaded chunks does not see the actors in the chunks that are not loaded.
+
+    python wwgen.py big.wwl --size 5000 --boxes 0.3 --walls 0.1 --monsters 0.01
+    python wwworld.py big.wwl world --chunk-size 64
+
+    world = wwworld.World('world', window=(30, 20))
+    GameLoop(world).run()
+    world.close()
+'''
+
+import argparse, collections, glob, json, os, struct, time
+
+import ww, wwlevel
+
+VERSION = 1
+CHUNK = struct.Struct('<4sBHI') # magic, version, palette size, entities
+CHUNK_MAGIC = b'WWCH'
+
+def chunk_of(stage, chunk_size, x, y):
+    '''
+    (Stage, int, int, int) -> tuple of two ints
+    Return the chunk of stage that the cell (x, y) belongs to, the
+    nearest one if (x, y) is off the stage.
+    '''
+
+    x = min(max(x, 0), stage.get_width() - 1)
+    y = min(max(y, 0), stage.get_height() - 1)
+    return (x // chunk_size, y // chunk_size)
+
+def chunk_path(directory, chunk):
+    '''
+    (str, tuple of two ints) -> str
+    Return the name of the file of chunk in the world directory.
+    '''
+
+    return os.path.join(directory, 'chunk-%d-%d.wwc' % chunk)
+
+def write_chunk(stage, path, actors):
+    '''
+    (Stage, str, list of Actor) -> None
+    Write actors to the chunk file path, or remove it if there are none.
+    '''
+
+    if not actors:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    palette = wwlevel.Palette()
+    entities = wwlevel.pack_actors(stage, actors, palette)
+    with open(path, 'wb') as f:
+        f.write(CHUNK.pack(CHUNK_MAGIC, VERSION, len(palette.entries),
+                           len(entities) // wwlevel.ENTITY.size))
+        palette.write(f)
+        f.write(entities)
+
+def read_chunk(stage, path):
+    '''
+    (Stage, str) -> list of Actor
+    Return the actors for stage in the chunk file path, none if there is
+    no such file.
+    '''
+
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < CHUNK.size:
+        raise ValueError('%s is not a chunk file' % path)
+    magic, version, num_codes, num_entities = CHUNK.unpack_from(data)
+    if magic != CHUNK_MAGIC or version != VERSION:
+        raise ValueError('%s is not a chunk file this version can load' % path)
+    palette, offset = wwlevel.Palette.read(data, CHUNK.size, num_codes)
+    entities = data[offset:offset + num_entities * wwlevel.ENTITY.size]
+    if len(entities) != num_entities * wwlevel.ENTITY.size:
+        raise ValueError('%s is cut short' % path)
+    return wwlevel.unpack_actors(stage, entities, palette)[0]
+
+def split(stage, directory, chunk_size=64):
+    '''
+    (Stage, str, int) -> int
+    Write everything on stage to the world directory, which is made if
+    needed, cut into chunks of chunk_size by chunk_size cells. Return the
+    number of chunk files written.
+    '''
+
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'chunk-*.wwc')):
+        os.remove(path)
+    player = stage._player
+    if player is not None and player._seq is None:
+        player = None
+    wwlevel.save(stage, os.path.join(directory, 'world.wwl'), [] if player is None else [player])
+
+    chunks = {} # chunk -> its actors, in stage order
+    for a in stage.get_actors():
+        if a is not player:
+            chunks.setdefault(chunk_of(stage, chunk_size, *a.get_position()), []).append(a)
+    for chunk, actors in chunks.items():
+        write_chunk(stage, chunk_path(directory, chunk), actors)
+    with open(os.path.join(directory, 'world.json'), 'w') as f:
+        json.dump({'version': VERSION, 'chunk_size': chunk_size}, f)
+    return len(chunks)
+
+class World(ww.StageWrapper):
+    '''
+    Plays the world in a directory written by split, keeping only the
+    chunks around the player loaded. See the module docstring. A World
+    can be used wherever a Stage is stepped (for example, given to a
+    GameLoop).
+    '''
+
+    def __init__(self, directory, radius=2, active_radius=1, slow_every=0, max_chunks=None,
+                 headless=False, icons=True, window=None):
+        '''
+        (World, str, int, int, int, int, bool, bool, tuple of two ints) -> None
+        Open the world in directory and load the chunks around the player.
+        active_radius must be less than radius. max_chunks is at least the
+        (2*radius + 1)**2 chunks around the player, and twice that by
+        default. headless, icons and window are passed on to the Stage.
+        '''
+
+        if not 0 <= active_radius < radius:
+            raise ValueError('active_radius must be at least 0 and less than radius')
+        with open(os.path.join(directory, 'world.json')) as f:
+            info = json.load(f)
+        if info.get('version') != VERSION:
+            raise ValueError('%s is not a world this version can load' % directory)
+        self._directory = directory
+        self._chunk_size = info['chunk_size']
+        super().__init__(wwlevel.load(os.path.join(directory, 'world.wwl'),
+                                      headless=headless, icons=icons, window=window))
+        self._radius = radius
+        self._active_radius = active_radius
+        self._slow_every = slow_every
+        side = 2 * radius + 1
+        self._max_chunks = max(max_chunks or 2 * side * side, side * side)
+        self._loaded = collections.OrderedDict() # loaded chunks, the least recently near first
+        self._focus = None # the chunk of the player
+        self._ticks = 0
+        self._reach = active_radius # chunks around the player whose actors step this tick
+        self._stage.set_step_filter(self._near)
+        self.update()
+
+    def get_stage(self):
+        '''
+        (World) -> Stage
+        Return the Stage the loaded chunks are on.
+        '''
+
+        return self._stage
+
+    def get_loaded(self):
+        '''
+        (World) -> list of tuple of two ints
+        Return the loaded chunks, the least recently near the player first.
+        '''
+
+        return list(self._loaded)
+
+    def update(self):
+        '''
+        (World) -> None
+        Load the chunks within radius of the player's chunk, and unload the
+        least recently used ones if too many are loaded. Called by step.
+        '''
+
+        stage = self._stage
+        player = stage._player
+        if player is not None and player._seq is not None:
+            focus = chunk_of(stage, self._chunk_size, *player.get_position())
+        elif self._focus is None: # no player, stay in the middle
+            focus = chunk_of(stage, self._chunk_size, stage.get_width() // 2, stage.get_height() // 2)
+        else:
+            focus = self._focus
+        if focus == self._focus:
+            return
+        self._focus = (fx, fy) = focus
+
+        columns = -(-stage.get_width() // self._chunk_size)
+        rows = -(-stage.get_height() // self._chunk_size)
+        r = self._radius
+        for cy in range(max(fy - r, 0), min(fy + r + 1, rows)):
+            for cx in range(max(fx - r, 0), min(fx + r + 1, columns)):
+                chunk = (cx, cy)
+                if chunk in self._loaded:
+                    self._loaded.move_to_end(chunk)
+                else:
+                    for actor in read_chunk(stage, chunk_path(self._directory, chunk)):
+                        stage.add_actor(actor)
+                    self._loaded[chunk] = None
+        if len(self._loaded) > self._max_chunks:
+            self._unload(list(self._loaded)[:len(self._loaded) - self._max_chunks])
+
+    def _unload(self, chunks):
+        '''
+        (World, list of tuple of two ints) -> None
+        Write the actors of chunks back to their files and take them off
+        the Stage.
+        '''
+
+        stage = self._stage
+        actors = {chunk: [] for chunk in chunks}
+        for a in stage.get_actors():
+            if a is not stage._player:
+                group = actors.get(chunk_of(stage, self._chunk_size, *a.get_position()))
+                if group is not None:
+                    group.append(a)
+        for chunk in chunks:
+            write_chunk(stage, chunk_path(self._directory, chunk), actors[chunk])
+            del self._loaded[chunk]
+        stage.remove_actors([a for group in actors.values() for a in group])
+
+    def step(self):
+        '''
+        (World) -> None
+        Load and unload chunks as the player moves, then step the stage,
+        whose step filter leaves out the actors of the chunks too far from
+        the player.
+        '''
+
+        self.update()
+        self._ticks += 1
+        self._reach = self._active_radius
+        if self._slow_every and self._ticks % self._slow_every == 0:
+            self._reach = self._radius - 1
+        super().step()
+
+    def _near(self, actor):
+        '''
+        (World, Actor) -> bool
+        Return True iff actor is in a chunk near enough to the player to
+        step this tick.
+        '''
+
+        (cx, cy) = chunk_of(self._stage, self._chunk_size, actor._x, actor._y)
+        (fx, fy) = self._focus
+        return abs(cx - fx) <= self._reach and abs(cy - fy) <= self._reach
+
+    def close(self):
+        '''
+        (World) -> None
+        Write the loaded chunks and the player back to the world directory.
+        '''
+
+        self._unload(list(self._loaded))
+        stage = self._stage
+        stage.set_step_filter(None)
+        player = stage._player
+        keep = [player] if player is not None and player._seq is not None else []
+        wwlevel.save(stage, os.path.join(self._directory, 'world.wwl'), keep)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cut a level file into a world of chunks.')
+    parser.add_argument('level')
+    parser.add_argument('world', help='the directory to write the world to')
+    parser.add_argument('--chunk-size', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stage = wwlevel.load(args.level, headless=True, icons=False)
+    chunks = split(stage, args.world, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'level': args.level,
+                      'world': args.world,
+                      'chunk_size': args.chunk_size,
+                      'actors': len(stage.get_actors()),
+                      'chunk_files': chunks,
+                      'split_seconds': elapsed}, indent=2))
+
+if __name__ == '__main__':
+    main()